@@ -1,64 +1,259 @@
 import os
+import sys
 import cv2
+import json
+import shutil
+import argparse
+import subprocess
 import numpy as np
 from pathlib import Path
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection, Iterator, List, Optional, Tuple
 
-def create_debug_video(debug_dir='debug', output_file='debug_visualization.mp4', frames_per_step=30):
-    # Get all debug directories sorted by timestamp
-    debug_path = Path(debug_dir)
+def find_sessions(debug_dir='debug', since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  exclude: Collection[str] = ()) -> List[Tuple[datetime, Path]]:
+    """Debug session directories sorted by timestamp, optionally limited to [since, until].
+
+    Names in exclude (already rendered sessions) are skipped before any parsing.
+    """
     debug_dirs = []
-    
-    for d in debug_path.iterdir():
-        if d.is_dir() and d.name.startswith('202'):  # Filter for timestamp directories
+
+    with os.scandir(debug_dir) as entries:
+        for entry in entries:
+            # Filter for timestamp directories
+            if not entry.name.startswith('202') or entry.name in exclude or not entry.is_dir():
+                continue
             try:
                 # Parse the timestamp from directory name
-                timestamp = datetime.strptime(d.name, '%Y-%m-%dT%H-%M-%S-%fZ')
-                debug_dirs.append((timestamp, d))
+                timestamp = datetime.strptime(entry.name, '%Y-%m-%dT%H-%M-%S-%fZ')
             except ValueError:
                 continue
-    
+            if (since is None or timestamp >= since) and (until is None or timestamp <= until):
+                debug_dirs.append((timestamp, Path(entry.path)))
+
     # Sort directories by timestamp
     debug_dirs.sort(key=lambda x: x[0])
-    
+    return debug_dirs
+
+def letterbox(frame: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Scale frame to fit width x height keeping its aspect ratio, padding the rest with black"""
+    frame_height, frame_width = frame.shape[:2]
+    if (frame_width, frame_height) == (width, height):
+        return frame
+    scale = min(width / frame_width, height / frame_height)
+    scaled_width, scaled_height = max(1, round(frame_width * scale)), max(1, round(frame_height * scale))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(frame, (scaled_width, scaled_height), interpolation=interpolation)
+    canvas = np.zeros((height, width, 3), dtype=frame.dtype)
+    top, left = (height - scaled_height) // 2, (width - scaled_width) // 2
+    canvas[top:top + scaled_height, left:left + scaled_width] = resized
+    return canvas
+
+def load_frame(path: Path, size: Tuple[int, int]) -> Optional[np.ndarray]:
+    # cv2 releases the GIL while decoding and resizing, so this scales across threads
+    frame = cv2.imread(str(path))
+    if frame is None:
+        return None
+    return letterbox(frame, *size)
+
+def iter_frames(paths: List[Path], size: Tuple[int, int], workers: int, read_ahead: int) -> Iterator[Tuple[Path, Optional[np.ndarray]]]:
+    """Decode frames on a thread pool, yielding them in order with at most read_ahead decoded or in flight"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = iter(paths)
+        for path in remaining:
+            pending.append((path, pool.submit(load_frame, path, size)))
+            if len(pending) >= read_ahead:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(load_frame, next_path, size)))
+            yield path, future.result()
+
+def first_frame_size(paths: List[Path]) -> Optional[Tuple[int, int]]:
+    for path in paths:
+        frame = cv2.imread(str(path))
+        if frame is not None:
+            return frame.shape[1], frame.shape[0]
+    return None
+
+def render_frames(vis_paths: List[Path], output_file: str, resolution: Tuple[int, int], fps: float,
+                  frames_per_step: int, workers: int, read_ahead: int) -> List[Path]:
+    """Encode vis_paths into output_file, returning the paths that were written"""
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_file, fourcc, fps, resolution)
+
+    written = []
+    for vis_path, frame in iter_frames(vis_paths, resolution, workers, read_ahead):
+        if frame is None:
+            print(f"Failed to read {vis_path}")
+            continue
+        for _ in range(frames_per_step):
+            out.write(frame)
+        written.append(vis_path)
+        print(f"Processed {vis_path}")
+
+    # Release video writer
+    out.release()
+    return written
+
+def create_debug_video(debug_dir='debug', output_file='debug_visualization.mp4', step_duration=1.0,
+                       fps: Optional[float] = None, resolution: Optional[Tuple[int, int]] = None,
+                       since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       workers: Optional[int] = None, read_ahead: Optional[int] = None):
+    """Render every session's visualization.png into one video, step_duration seconds per session.
+
+    By default the video runs at 1 / step_duration fps so each step is written
+    once; a higher fps repeats frames to fill the step. Frames are letterboxed
+    to resolution, or to the first frame's size.
+    """
+    debug_dirs = find_sessions(debug_dir, since, until)
     if not debug_dirs:
         print("No debug directories found!")
         return
-    
+
+    vis_paths = [d / 'visualization.png' for _, d in debug_dirs]
+    vis_paths = [path for path in vis_paths if path.exists()]
+    if not vis_paths:
+        print("No visualization images found!")
+        return
+
     # Get first image to determine dimensions
-    first_vis = None
-    for _, d in debug_dirs:
-        vis_path = d / 'visualization.png'
-        if vis_path.exists():
-            first_vis = cv2.imread(str(vis_path))
-            break
-    
-    if first_vis is None:
+    resolution = resolution or first_frame_size(vis_paths)
+    if resolution is None:
+        print("No readable visualization images found!")
+        return
+
+    fps = fps or 1.0 / step_duration
+    workers = workers or min(8, os.cpu_count() or 1)
+    written = render_frames(vis_paths, output_file, resolution, fps, max(1, round(step_duration * fps)),
+                            workers, max(1, read_ahead or workers * 2))
+    print(f"\nVideo saved to {output_file} ({len(written)} steps, {resolution[0]}x{resolution[1]} at {fps:g} fps)")
+
+def load_manifest(segments_dir: Path) -> dict:
+    manifest_path = segments_dir / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {"settings": None, "segments": []}
+
+def save_manifest(segments_dir: Path, manifest: dict):
+    # Write then rename so an interrupted run never leaves a truncated manifest
+    tmp_path = segments_dir / 'manifest.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, segments_dir / 'manifest.json')
+
+def concat_segments(segment_files: List[Path], output_file: str):
+    """Join segments into output_file with ffmpeg's concat demuxer, copying streams without re-encoding"""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is needed to join segments; install it or run without --incremental")
+    list_path = segment_files[0].parent / 'concat.txt'
+    with open(list_path, 'w') as f:
+        for segment in segment_files:
+            quoted = str(segment.resolve()).replace("'", "'\\''")
+            f.write(f"file '{quoted}'\n")
+    subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', str(list_path),
+                    '-c', 'copy', output_file], check=True)
+
+def update_debug_video(debug_dir='debug', output_file='debug_visualization.mp4', segments_dir='debug_video_segments',
+                       step_duration=1.0, fps: Optional[float] = None, resolution: Optional[Tuple[int, int]] = None,
+                       since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       workers: Optional[int] = None, read_ahead: Optional[int] = None):
+    """Incremental build: encode only sessions not yet in the manifest into a new segment, then join all segments.
+
+    Segments are only joined when they share resolution and frame rate, so a
+    change to either starts the segments over. Sessions without a readable
+    visualization yet are left for the next run. Raises RuntimeError up front
+    if ffmpeg isn't installed, before anything is rendered.
+    """
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg is needed to join segments; install it or run without --incremental")
+    segments_path = Path(segments_dir)
+    segments_path.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(segments_path)
+
+    fps = fps or 1.0 / step_duration
+    previous = manifest["settings"]
+    resolution = resolution or (tuple(previous["resolution"]) if previous else None)
+    if previous and (tuple(previous["resolution"]) != resolution or previous["fps"] != fps
+                     or previous["step_duration"] != step_duration):
+        print("Video settings changed; re-rendering all sessions")
+        manifest = {"settings": None, "segments": []}
+
+    rendered = {name for segment in manifest["segments"] for name in segment["sessions"]}
+    new_sessions = find_sessions(debug_dir, since, until, exclude=rendered)
+    vis_paths = [path for path in (d / 'visualization.png' for _, d in new_sessions) if path.exists()]
+
+    if vis_paths:
+        resolution = resolution or first_frame_size(vis_paths)
+        if resolution is None:
+            print("No readable visualization images found!")
+            return
+        workers = workers or min(8, os.cpu_count() or 1)
+        segment_name = f"segment_{len(manifest['segments']):06d}.mp4"
+        tmp_file = segments_path / f"{segment_name}.tmp.mp4"
+        written = render_frames(vis_paths, str(tmp_file), resolution, fps, max(1, round(step_duration * fps)),
+                                workers, max(1, read_ahead or workers * 2))
+        if written:
+            os.replace(tmp_file, segments_path / segment_name)
+            manifest["settings"] = {"resolution": list(resolution), "fps": fps, "step_duration": step_duration}
+            manifest["segments"].append({
+                "file": segment_name,
+                "sessions": [path.parent.name for path in written],
+                "created_at": datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+            })
+            save_manifest(segments_path, manifest)
+        else:
+            tmp_file.unlink(missing_ok=True)
+        print(f"Rendered {len(written)} new sessions into {segment_name}")
+    elif Path(output_file).exists():
+        print(f"No new sessions; {output_file} is up to date")
+        return
+
+    if not manifest["segments"]:
         print("No visualization images found!")
         return
-    
-    # Initialize video writer
-    height, width = first_vis.shape[:2]
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_file, fourcc, 30.0, (width, height))
-    
-    # Process each debug directory
-    for timestamp, debug_dir in debug_dirs:
-        vis_path = debug_dir / 'visualization.png'
-        
-        if vis_path.exists():
-            frame = cv2.imread(str(vis_path))
-            if frame is not None:
-                # Write the same frame multiple times to create a pause
-                for _ in range(frames_per_step):
-                    out.write(frame)
-                print(f"Processed {vis_path}")
-            else:
-                print(f"Failed to read {vis_path}")
-    
-    # Release video writer
-    out.release()
-    print(f"\nVideo saved to {output_file}")
+    concat_segments([segments_path / segment["file"] for segment in manifest["segments"]], output_file)
+    total = sum(len(segment["sessions"]) for segment in manifest["segments"])
+    print(f"\nVideo saved to {output_file} ({total} steps from {len(manifest['segments'])} segments)")
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {value!r}")
+    return width, height
+
+def main():
+    parser = argparse.ArgumentParser(description="Render debug session visualizations into a video")
+    parser.add_argument('--debug-dir', default='debug')
+    parser.add_argument('--output', default='debug_visualization.mp4')
+    parser.add_argument('--step-duration', type=float, default=1.0, help='seconds each session stays on screen')
+    parser.add_argument('--fps', type=float, help='output frame rate (default: one frame per step)')
+    parser.add_argument('--resolution', type=parse_resolution, help='WIDTHxHEIGHT (default: first frame size)')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='only sessions at or after this time (UTC)')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='only sessions at or before this time (UTC)')
+    parser.add_argument('--workers', type=int, help='decode threads (default: CPU count, up to 8)')
+    parser.add_argument('--read-ahead', type=int, help='frames decoded ahead of the writer (default: 2x workers)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='encode only sessions not rendered before and join them with earlier segments (needs ffmpeg)')
+    parser.add_argument('--segments-dir', default='debug_video_segments', help='segments and manifest for --incremental')
+    args = parser.parse_args()
+    if args.incremental:
+        try:
+            update_debug_video(args.debug_dir, args.output, args.segments_dir, args.step_duration, args.fps,
+                               args.resolution, args.since, args.until, args.workers, args.read_ahead)
+        except RuntimeError as e:
+            sys.exit(str(e))
+    else:
+        create_debug_video(args.debug_dir, args.output, args.step_duration, args.fps, args.resolution,
+                           args.since, args.until, args.workers, args.read_ahead)
 
 if __name__ == "__main__":
-    create_debug_video() 
\ No newline at end of file
+    main()
@@ -0,0 +1,238 @@
+"""Fake input, screen and model backends for running the automation service headless.
+
+install_fakes() puts a fake pyautogui and pyperclip into sys.modules and a
+stub model into the model registry, so the service runs without a display
+or Vertex AI. The fake screen shows a window onto a tall synthetic page
+that scrolls (with a short animation) when the service scrolls.
+"""
+import sys
+import json
+import time
+import types
+import random
+import base64
+import threading
+from typing import List, Optional
+import numpy as np
+from PIL import Image, ImageDraw
+
+class SyntheticPage:
+    """Tall page of numbered records, rendered once up front"""
+
+    def __init__(self, width: int = 1280, height: int = 6000, record_height: int = 140, seed: int = 0):
+        rng = random.Random(seed)
+        image = Image.new('RGB', (width, height), (250, 250, 250))
+        draw = ImageDraw.Draw(image)
+        self.records = []
+        for index, top in enumerate(range(20, height - record_height, record_height)):
+            accent = tuple(rng.randrange(40, 200) for _ in range(3))
+            draw.rectangle((20, top, width - 20, top + record_height - 20), outline=(210, 210, 210), fill=(255, 255, 255))
+            draw.ellipse((36, top + 16, 76, top + 56), fill=accent)
+            title = f"Record {index}: {rng.choice(['Quarterly update', 'New release', 'Team news', 'Case study'])}"
+            draw.text((92, top + 18), title, fill=(20, 20, 20))
+            # Grey bars stand in for body text; varying widths give every record a distinct profile
+            for line in range(3):
+                bar_width = rng.randrange(width // 4, width - 160)
+                draw.rectangle((92, top + 48 + line * 20, 92 + bar_width, top + 58 + line * 20), fill=(190, 190, 190))
+            self.records.append({"index": index, "top": top, "title": title})
+        self.pixels = np.asarray(image)
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+class FakeScreen:
+    """Screen showing the page at a scroll offset, with counters for every input event"""
+
+    def __init__(self, page: SyntheticPage, size=(1280, 800), pixels_per_unit: float = 12.0,
+                 scroll_animation: float = 0.08, input_latency: float = 0.0, screenshot_latency: float = 0.0):
+        self.page = page
+        self.size = size
+        self.pixels_per_unit = pixels_per_unit
+        self.scroll_animation = scroll_animation
+        self.input_latency = input_latency
+        self.screenshot_latency = screenshot_latency
+        self.lock = threading.Lock()
+        self.events = {}
+        self.position = (0, 0)
+        self.clipboard = ""
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._scroll_from = self._scroll_to = 0.0
+            self._scroll_started = 0.0
+
+    @property
+    def max_offset(self) -> float:
+        return max(0, self.page.height - self.size[1])
+
+    def offset(self) -> int:
+        """Offset currently on screen; scrolls ease towards their target over scroll_animation seconds"""
+        with self.lock:
+            progress = 1.0
+            if self.scroll_animation > 0:
+                progress = min(1.0, (time.monotonic() - self._scroll_started) / self.scroll_animation)
+            return round(self._scroll_from + (self._scroll_to - self._scroll_from) * progress)
+
+    def _event(self, name: str):
+        self.events[name] = self.events.get(name, 0) + 1
+        if self.input_latency:
+            time.sleep(self.input_latency)
+
+    def scroll(self, clicks: int):
+        current = self.offset()
+        with self.lock:
+            self._event('scroll')
+            self._scroll_from = current
+            self._scroll_to = min(self.max_offset, max(0.0, self._scroll_to - clicks * self.pixels_per_unit))
+            self._scroll_started = time.monotonic()
+
+    def screenshot(self) -> Image.Image:
+        self._event('screenshot')
+        if self.screenshot_latency:
+            time.sleep(self.screenshot_latency)
+        top = self.offset()
+        width, height = self.size
+        view = np.full((height, width, 3), 250, dtype=np.uint8)
+        visible = self.page.pixels[top:top + height, :width]
+        view[:visible.shape[0], :visible.shape[1]] = visible
+        return Image.fromarray(view)
+
+def fake_pyautogui_module(screen: FakeScreen) -> types.ModuleType:
+    module = types.ModuleType('pyautogui')
+    module.FAILSAFE = True
+    module.PAUSE = 0.1
+
+    def move_to(x, y, duration=0.0, _pause=True, **kwargs):
+        screen._event('move')
+        if duration:
+            time.sleep(duration)
+        screen.position = (x, y)
+
+    def record(name):
+        def handler(*args, **kwargs):
+            screen._event(name)
+        return handler
+
+    module.moveTo = move_to
+    module.click = record('click')
+    module.press = record('press')
+    module.hotkey = record('hotkey')
+    module.typewrite = record('typewrite')
+    module.hscroll = record('hscroll')
+    module.scroll = lambda clicks, _pause=True, **kwargs: screen.scroll(clicks)
+    module.screenshot = lambda *args, **kwargs: screen.screenshot()
+    module.size = lambda: screen.size
+    return module
+
+def fake_pyperclip_module(screen: FakeScreen) -> types.ModuleType:
+    module = types.ModuleType('pyperclip')
+    module.PyperclipException = RuntimeError
+    module.paste = lambda: screen.clipboard
+
+    def copy(text):
+        screen.clipboard = text
+    module.copy = copy
+    return module
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class StubPart:
+    """Stands in for a Vertex AI Part; inline_data.data is what payload metrics measure"""
+
+    def __init__(self, data: str, mime_type: str):
+        self.inline_data = types.SimpleNamespace(data=base64.b64decode(data), mime_type=mime_type)
+
+class StubResourceExhausted(RuntimeError):
+    """Quota error shaped like the SDK's 429, so the service retries it and backs off"""
+    code = 429
+
+class StubModel:
+    """generate_content replacement with configurable latency and canned JSON answers.
+
+    Each analysis returns a few records overlapping the previous call's, so the
+    merge step has duplicates to collapse. error_rate makes that fraction of
+    calls raise; fenced wraps answers in a markdown code block like Gemini often does.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0,
+                 records_per_analysis: int = 5, fenced: bool = False, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.records_per_analysis = records_per_analysis
+        self.fenced = fenced
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._next_record = 0
+        self._issued = set()
+
+    def _analysis(self) -> dict:
+        with self.lock:
+            start = self._next_record
+            self._next_record += self.records_per_analysis - 1
+            self._issued.update(range(start, start + self.records_per_analysis))
+        return {"content": [{"title": f"Record {index}", "text": f"Body text of record {index}"}
+                            for index in range(start, start + self.records_per_analysis)]}
+
+    def _answer(self, contents) -> dict:
+        parts: List = contents if isinstance(contents, list) else [contents]
+        prompt = parts[0] if parts and isinstance(parts[0], str) else ""
+        if "extraction plan" in prompt:
+            return {
+                "content_type": "record list",
+                "key_elements": ["title", "text"],
+                "extraction_schema": {"content": [{"title": "string", "text": "string"}]},
+                "extraction_prompt": "Extract every record with its title and text.",
+                "initial_analysis": self._analysis()
+            }
+        if "keyed by screenshot number" in prompt:
+            images = sum(1 for part in parts if isinstance(part, StubPart))
+            return {str(label): self._analysis() for label in range(images)}
+        if '"decisions"' in prompt:
+            return {"decisions": []}
+        return self._analysis()
+
+    def generate_content(self, contents, **kwargs) -> StubResponse:
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = max(0.0, self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+            fail = self.rng.random() < self.error_rate
+        try:
+            time.sleep(delay)
+            if fail:
+                with self.lock:
+                    self.errors += 1
+                raise StubResourceExhausted("Stub model error (429 Resource exhausted)")
+            text = json.dumps(self._answer(contents))
+            return StubResponse(f"```json\n{text}\n```" if self.fenced else text)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def take_issued(self) -> int:
+        """Distinct records handed out since the last call; what a correct merge should end up with"""
+        with self.lock:
+            issued, self._issued = len(self._issued), set()
+        return issued
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"calls": self.calls, "errors": self.errors, "max_in_flight": self.max_in_flight}
+
+def install_fakes(screen: FakeScreen, model: Optional[StubModel] = None):
+    """Install the fake input modules; call before the service imports pyautogui"""
+    sys.modules['pyautogui'] = fake_pyautogui_module(screen)
+    sys.modules['pyperclip'] = fake_pyperclip_module(screen)
+    if model is not None:
+        from model_client import model_registry
+        model_registry.use_stub(model, StubPart)
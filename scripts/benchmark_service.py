@@ -0,0 +1,317 @@
+"""Headless benchmarks for the automation service.
+
+Runs the service in-process on a free port with the fakes from
+benchmark_fakes (synthetic scrolling page, stub model), drives it over HTTP
+and writes a JSON report. Compare two reports to see how a change moved
+latency and throughput:
+
+    python scripts/benchmark_service.py --output before.json
+    python scripts/benchmark_service.py --output after.json --compare before.json
+
+Capture runs are also checked against the synthetic page (viewports
+reached, records kept by the merge); any problem is listed in the report
+and makes the script exit non-zero.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import http.client
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'src'))
+
+from benchmark_fakes import SyntheticPage, FakeScreen, StubModel, install_fakes
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[position]
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> dict:
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "latency_ms": {
+            "min": round(min(latencies) * 1000, 3),
+            "mean": round(statistics.mean(latencies) * 1000, 3),
+            "p50": round(percentile(latencies, 0.5) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3)
+        }
+    }
+
+class Client:
+    """JSON-over-HTTP client keeping one connection per thread"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Optional[dict] = None, timeout: float = 120.0):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        reused = getattr(self._local, 'connection', None) is not None
+        if not reused:
+            self._local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        connection = self._local.connection
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            if reused:
+                # The server closes keep-alive connections left idle between scenarios; retry on a new one
+                return self.request(method, path, body, timeout)
+            raise
+        return response.status, json.loads(data) if data else None
+
+def run_load(client: Client, method: str, path: str, make_body: Callable[[int], dict],
+             requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(index: int):
+        nonlocal errors
+        started = time.monotonic()
+        try:
+            status, _ = client.request(method, path, make_body(index))
+            ok = status < 400
+        except Exception:
+            ok = False
+        elapsed = time.monotonic() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(latencies, errors, time.monotonic() - started)
+
+def stage_summary(snapshot: dict) -> dict:
+    """Per-stage count, total and mean seconds from a metrics JSON snapshot"""
+    stages = {}
+    for series in snapshot["histograms"].get("chicory_stage_seconds", []):
+        stages[series["labels"]["stage"]] = {
+            "count": series["count"],
+            "total_s": round(series["sum"], 4),
+            "mean_ms": round(series["mean"] * 1000, 3) if series["mean"] is not None else None
+        }
+    return stages
+
+def input_scenarios(profile: str, window: dict) -> Dict[str, tuple]:
+    """name -> (method, path, body factory) for the single-action endpoints"""
+    return {
+        "mouse_move": ("POST", "/mouse/move", lambda i: {"x": 100 + i % 500, "y": 200, "timing_profile": profile}),
+        "mouse_click": ("POST", "/mouse/click", lambda i: {"x": 300, "y": 300, "timing_profile": profile}),
+        "keyboard_type": ("POST", "/keyboard/type", lambda i: {"text": f"benchmark text {i}", "timing_profile": profile}),
+        "keyboard_key": ("POST", "/keyboard/key", lambda i: {"key": "enter", "timing_profile": profile}),
+        "execute_click": ("POST", "/execute", lambda i: {
+            "action": "click", "bbox": {"x": 100, "y": 100, "width": 80, "height": 30},
+            "window_info": window, "timing_profile": profile}),
+        "execute_type": ("POST", "/execute", lambda i: {
+            "action": "type", "input_text": "hello world", "window_info": window, "timing_profile": profile}),
+        "execute_batch": ("POST", "/execute/batch", lambda i: {
+            "actions": [
+                {"action": "click", "bbox": {"x": 100, "y": 100, "width": 80, "height": 30}},
+                {"action": "type", "input_text": "hello"},
+                {"action": "keyboard", "key_command": "enter"}
+            ],
+            "window_info": window, "timing_profile": profile})
+    }
+
+CAPTURE_VARIANTS = {
+    "scroll_and_capture": {},
+    "scroll_and_capture_sequential": {"pipelined": False},
+    "scroll_and_capture_batched": {"analysis_batch_size": 3},
+    "scroll_and_capture_strips": {"send_new_strips_only": True}
+}
+
+def check_capture(result: dict, screen: FakeScreen, max_viewports: int, issued_records: int) -> List[str]:
+    """What's wrong with one scroll_and_capture result on the synthetic page, if anything.
+
+    A faster run that skips part of the page or merges distinct records
+    isn't a speedup, so these fail the benchmark instead of being reported.
+    """
+    problems = []
+    end_of_content = result["viewport_info"].get("end_of_content")
+    if end_of_content and screen.offset() < screen.max_offset:
+        problems.append(f"end_of_content at offset {screen.offset()} of {screen.max_offset:.0f}")
+    if not end_of_content and result["viewport_count"] != max_viewports:
+        problems.append(f"{result['viewport_count']} of {max_viewports} viewports without reaching the end")
+    # Every record the stub model handed out is distinct, so none may be merged away
+    records = len(result["merged_analysis"].get("content") or [])
+    if records != issued_records:
+        problems.append(f"{records} merged records, expected {issued_records}")
+    return problems
+
+def run_capture(client: Client, screen: FakeScreen, model: StubModel, window: dict, runs: int,
+                max_viewports: int, profile: str, overrides: dict) -> dict:
+    from metrics import metrics
+    metrics.reset()
+    latencies, viewports, errors, problems = [], [], 0, []
+    started = time.monotonic()
+    for run in range(runs):
+        screen.reset()
+        model.take_issued()
+        body = {"x": 640, "y": 400, "window_info": window, "goal": "Extract records", "use_cache": False,
+                "max_viewports": max_viewports, "timing_profile": profile, "save_screenshots": True, **overrides}
+        run_started = time.monotonic()
+        status, result = client.request("POST", "/mouse/scroll_and_capture", body)
+        if status >= 400 or not result or not result.get("success"):
+            errors += 1
+            continue
+        latencies.append(time.monotonic() - run_started)
+        viewports.append(result["viewport_count"])
+        problems.extend(f"run {run}: {problem}"
+                        for problem in check_capture(result, screen, max_viewports, model.take_issued()))
+    report = summarize(latencies, errors, time.monotonic() - started)
+    report["viewports_per_run"] = round(statistics.mean(viewports), 2) if viewports else 0
+    report["problems"] = problems
+    report["stages"] = stage_summary(metrics.to_dict())
+    return report
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report: dict, baseline: dict) -> List[str]:
+    """One line per scenario: p50 latency and throughput relative to the baseline"""
+    lines = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or "latency_ms" not in current or "latency_ms" not in previous:
+            continue
+        p50, old_p50 = current["latency_ms"]["p50"], previous["latency_ms"]["p50"]
+        line = f"{name:32s} p50 {old_p50:9.2f} -> {p50:9.2f} ms ({(p50 / old_p50 - 1) * 100 if old_p50 else 0:+.1f}%)"
+        if current.get("throughput_rps") and previous.get("throughput_rps"):
+            line += f"  throughput {previous['throughput_rps']:8.2f} -> {current['throughput_rps']:8.2f} rps"
+        lines.append(line)
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the automation service")
+    parser.add_argument('--scenarios', nargs='*', help='scenario names to run (default: all)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per input scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients for input scenarios')
+    parser.add_argument('--capture-runs', type=int, default=3)
+    parser.add_argument('--max-viewports', type=int, default=6)
+    parser.add_argument('--timing-profile', default='instant')
+    parser.add_argument('--model-latency', type=float, default=0.5, help='mean stub model latency in seconds')
+    parser.add_argument('--model-jitter', type=float, default=0.2, help='latency jitter as a fraction of the mean')
+    parser.add_argument('--model-error-rate', type=float, default=0.0)
+    parser.add_argument('--input-latency', type=float, default=0.0, help='seconds each fake input event takes')
+    parser.add_argument('--screenshot-latency', type=float, default=0.02, help='seconds each fake screenshot takes')
+    parser.add_argument('--output', type=Path, help='write the JSON report here (default: stdout)')
+    parser.add_argument('--compare', type=Path, help='earlier report to compare against')
+    parser.add_argument('--verbose', action='store_true', help='keep the service logs')
+    args = parser.parse_args()
+
+    output = args.output.resolve() if args.output else None
+    baseline_path = args.compare.resolve() if args.compare else None
+    # Captures and the analysis cache go to a scratch directory, not the working tree
+    workdir = tempfile.mkdtemp(prefix='chicory-bench-')
+    os.environ['CHICORY_ANALYSIS_CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ.setdefault('CHICORY_FOCUS_BACKEND', 'noop')
+    os.chdir(workdir)
+
+    page = SyntheticPage()
+    screen = FakeScreen(page, input_latency=args.input_latency, screenshot_latency=args.screenshot_latency)
+    model = StubModel(latency=args.model_latency, jitter=args.model_jitter, error_rate=args.model_error_rate)
+    install_fakes(screen, model)
+
+    import logging
+    import uvicorn
+    import automation_service
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(automation_service.app, host='127.0.0.1', port=port,
+                                           log_level='info' if args.verbose else 'warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    client = Client(port)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            status, health = client.request("GET", "/health")
+            if status == 200 and health.get("ready"):
+                break
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            sys.exit("Service did not become ready")
+        time.sleep(0.05)
+
+    width, height = screen.size
+    window = {"bounds": {"x": 0, "y": 0, "width": width, "height": height}, "owner": {"processId": os.getpid()}}
+    scenarios = {}
+    selected = set(args.scenarios) if args.scenarios else None
+    for name, (method, path, make_body) in input_scenarios(args.timing_profile, window).items():
+        if selected is None or name in selected:
+            scenarios[name] = run_load(client, method, path, make_body, args.requests, args.concurrency)
+            print(f"{name}: {scenarios[name].get('latency_ms', {}).get('p50')} ms p50", file=sys.stderr)
+    for name, overrides in CAPTURE_VARIANTS.items():
+        if selected is None or name in selected:
+            scenarios[name] = run_capture(client, screen, model, window, args.capture_runs, args.max_viewports,
+                                          args.timing_profile, overrides)
+            print(f"{name}: {scenarios[name].get('latency_ms', {}).get('p50')} ms p50", file=sys.stderr)
+
+    server.should_exit = True
+    thread.join(timeout=10)
+
+    report = {
+        "revision": git_revision(),
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "model": model.stats(),
+        "model_limiter": automation_service.model_limiter.stats(),
+        "input_events": dict(screen.events),
+        "scenarios": scenarios
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text + '\n')
+    else:
+        print(text)
+    if baseline_path:
+        for line in compare(report, json.loads(baseline_path.read_text())):
+            print(line, file=sys.stderr)
+    problems = [f"{name}: {problem}" for name, scenario in scenarios.items() for problem in scenario.get("problems", [])]
+    for problem in problems:
+        print(f"FAILED {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Measure how long the automation service takes to answer /health and flag regressions.
+
+Starts src/automation_service.py on a free port several times, records the
+time until /health first answers (and optionally until every subsystem
+reports ready), and compares the median with a stored baseline. A missing
+baseline is an error (exit code 2) unless --update is given.
+
+    python scripts/check_startup_time.py                 # compare with the baseline
+    python scripts/check_startup_time.py --update        # record a new baseline
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVICE = ROOT / 'src' / 'automation_service.py'
+DEFAULT_BASELINE = ROOT / 'scripts' / 'startup_baseline.json'
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def get_health(port: int):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=0.5) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+def measure_once(wait_ready: bool, timeout: float) -> dict:
+    port = free_port()
+    env = dict(os.environ, CHICORY_SERVICE_PORT=str(port))
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, str(SERVICE)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        while time.monotonic() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Service exited with code {process.returncode}")
+            health = get_health(port)
+            if health is not None:
+                if 'health_seconds' not in result:
+                    result['health_seconds'] = time.monotonic() - started
+                    result['reported_startup_time'] = health.get('startup_time')
+                if not wait_ready or health.get('ready'):
+                    if wait_ready:
+                        result['ready_seconds'] = time.monotonic() - started
+                    result['subsystems'] = health.get('subsystems')
+                    return result
+            time.sleep(0.02)
+        raise RuntimeError(f"Service did not become healthy within {timeout:.0f}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--wait-ready', action='store_true', help='also time until every subsystem is ready')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline, as a fraction')
+    parser.add_argument('--update', action='store_true', help='write the measured median as the new baseline')
+    args = parser.parse_args()
+    if not args.update and not args.baseline.exists():
+        # Without a baseline nothing is compared, and the check would pass no matter how slow startup got
+        print(f"No baseline at {args.baseline}; record one with --update on the reference machine", file=sys.stderr)
+        return 2
+
+    runs = [measure_once(args.wait_ready, args.timeout) for _ in range(args.runs)]
+    report = {'runs': runs, 'health_seconds': statistics.median(run['health_seconds'] for run in runs)}
+    if args.wait_ready:
+        report['ready_seconds'] = statistics.median(run['ready_seconds'] for run in runs)
+
+    if args.update:
+        args.baseline.write_text(json.dumps({key: report[key] for key in ('health_seconds', 'ready_seconds') if key in report}, indent=2) + '\n')
+        print(json.dumps(report, indent=2))
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = []
+    baseline = json.loads(args.baseline.read_text())
+    report['baseline'] = baseline
+    for key in ('health_seconds', 'ready_seconds'):
+        if key in baseline and key in report and report[key] > baseline[key] * (1 + args.tolerance):
+            regressions.append(f"{key}: {report[key]:.3f}s vs baseline {baseline[key]:.3f}s")
+    print(json.dumps(report, indent=2))
+    if regressions:
+        print("Startup time regression: " + "; ".join(regressions), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
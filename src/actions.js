@@ -25,6 +25,44 @@ async function checkServiceHealth(retries = 0) {
   }
 }
 
+/**
+ * Start a scroll-and-capture job and wait only until its screenshots are taken.
+ * Analysis and merging keep running in the service; fetch them later from
+ * /jobs/:id/result.
+ * @param {Object} body - ScrollAndCaptureRequest payload
+ * @returns {Promise<string>} The job id
+ */
+async function startScrollAndCaptureJob(body) {
+  const response = await fetch(`${AUTOMATION_SERVICE_URL}/jobs/scroll_and_capture`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body)
+  });
+
+  if (!response.ok) {
+    const error = await response.json().catch(() => response.text());
+    throw new Error(`Failed to start scroll and capture: ${JSON.stringify(error)}`);
+  }
+
+  const { job_id: jobId } = await response.json();
+
+  // The job drives the mouse while capturing, so don't run further actions until it's done with it
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, 250));
+    const statusResponse = await fetch(`${AUTOMATION_SERVICE_URL}/jobs/${jobId}`);
+    if (!statusResponse.ok) {
+      throw new Error(`Failed to get scroll and capture status: ${statusResponse.statusText}`);
+    }
+    const job = await statusResponse.json();
+    if (job.status === 'failed') {
+      throw new Error(`Scroll and capture failed: ${job.error}`);
+    }
+    if (job.status === 'succeeded' || job.status === 'cancelled' || job.progress.capture_complete) {
+      return jobId;
+    }
+  }
+}
+
 /**
  * Execute a sequence of UI actions
  * @param {Array} actions - Array of actions from Gemini
@@ -88,27 +126,17 @@ async function executeActions(actions, elements, windowInfo) {
         console.log('Scroll action at window center:', windowCenter);
 
         if (action.action === 'scroll_and_capture') {
-          const response = await fetch(`${AUTOMATION_SERVICE_URL}/mouse/scroll_and_capture`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              x: windowCenter.x,
-              y: windowCenter.y,
-              goal: 'Extract visible content and structure',
-              window_info: {
-                owner: windowInfo.owner,
-                bounds: windowInfo.bounds,
-                title: windowInfo.title
-              }
-            })
+          const jobId = await startScrollAndCaptureJob({
+            x: windowCenter.x,
+            y: windowCenter.y,
+            goal: 'Extract visible content and structure',
+            window_info: {
+              owner: windowInfo.owner,
+              bounds: windowInfo.bounds,
+              title: windowInfo.title
+            }
           });
-
-          if (!response.ok) {
-            throw new Error(`Scroll and capture failed: ${response.statusText}`);
-          }
-
-          const result = await response.json();
-          console.log('Scroll and capture completed:', result);
+          console.log('Scroll and capture captured, analysis continuing in job:', jobId);
         } else {
           const response = await fetch(`${AUTOMATION_SERVICE_URL}/mouse/scroll`, {
             method: 'POST',
@@ -466,30 +494,19 @@ async function executeActions(actions, elements, windowInfo) {
             windowSize: { width: windowInfo.bounds.width, height: windowInfo.bounds.height }
           });
 
-          // Send scroll and capture request at window center
-          const response = await fetch(`${AUTOMATION_SERVICE_URL}/mouse/scroll_and_capture`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              x: windowCenterX,
-              y: windowCenterY,
-              simulate_wheel: true,
-              window_info: {
-                owner: windowInfo.owner,
-                bounds: windowInfo.bounds,
-                title: windowInfo.title,
-                focus: true // Request window focus before scrolling
-              }
-            })
+          // Start scroll and capture at window center; analysis finishes in the background
+          const jobId = await startScrollAndCaptureJob({
+            x: windowCenterX,
+            y: windowCenterY,
+            simulate_wheel: true,
+            window_info: {
+              owner: windowInfo.owner,
+              bounds: windowInfo.bounds,
+              title: windowInfo.title,
+              focus: true // Request window focus before scrolling
+            }
           });
-
-          if (!response.ok) {
-            const error = await response.json().catch(() => response.text());
-            throw new Error(`Failed to scroll and capture: ${JSON.stringify(error)}`);
-          }
-
-          const result = await response.json();
-          console.log('Scroll and capture completed:', result);
+          console.log('Scroll and capture captured, analysis continuing in job:', jobId);
           break;
         }
       }
@@ -0,0 +1,183 @@
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "analyses")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600  # One week
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 8) -> str:
+    """Difference hash (dHash) of an encoded image, stable across re-encodes and tiny pixel noise"""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+class AnalysisCache:
+    """Content-addressed on-disk cache for model analyses of screenshots.
+
+    Each entry is one JSON file named after a hash of the image plus the
+    prompt and schema. Reads refresh the file's mtime so eviction can drop
+    the least recently used entries once the cache exceeds max_bytes.
+    Entries older than ttl_seconds are treated as misses and deleted.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, key_mode: str = "content", enabled: bool = True):
+        if key_mode not in ("content", "perceptual"):
+            raise ValueError(f"Unknown cache key mode: {key_mode}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.key_mode = key_mode
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size in bytes, last access time); loaded lazily from disk
+        self._index: Optional[Dict[str, Tuple[int, float]]] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        # Caller holds self._lock
+        if self._index is not None:
+            return
+        self._index = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            self._index[filename[:-len('.json')]] = (stat.st_size, stat.st_mtime)
+
+    def make_key(self, image_bytes: bytes, prompt: str, schema: Optional[Any] = None) -> str:
+        """Build a cache key from the image and everything else sent to the model"""
+        if self.key_mode == "perceptual":
+            image_key = perceptual_hash(image_bytes)
+        else:
+            image_key = hashlib.sha256(image_bytes).hexdigest()
+        digest = hashlib.sha256()
+        digest.update(image_key.encode())
+        digest.update(prompt.encode())
+        digest.update(json.dumps(schema, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _remove(self, key: str):
+        # Caller holds self._lock
+        self._index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached analysis for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            if self.ttl_seconds and time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+                self._remove(key)
+                self.misses += 1
+                return None
+            now = time.time()
+            try:
+                os.utime(self._path(key), (now, now))
+            except OSError:
+                pass
+            self._index[key] = (self._index[key][0], now)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key: str, value: dict):
+        """Store an analysis and evict least recently used entries if over budget"""
+        if not self.enabled:
+            return
+        data = json.dumps({"created_at": time.time(), "value": value})
+        with self._lock:
+            self._load_index()
+            tmp_path = self._path(key) + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.error(f"Error writing analysis cache entry: {e}")
+                return
+            self._index[key] = (len(data), time.time())
+            self._evict()
+
+    def _evict(self):
+        # Caller holds self._lock
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Delete every entry and reset counters"""
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "key_mode": self.key_mode,
+                "entries": len(self._index),
+                "size_bytes": sum(size for size, _ in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+analysis_cache = AnalysisCache(
+    cache_dir=os.getenv('CHICORY_ANALYSIS_CACHE_DIR', DEFAULT_CACHE_DIR),
+    max_bytes=int(os.getenv('CHICORY_ANALYSIS_CACHE_MAX_BYTES', str(DEFAULT_MAX_BYTES))),
+    ttl_seconds=float(os.getenv('CHICORY_ANALYSIS_CACHE_TTL', str(DEFAULT_TTL_SECONDS))),
+    key_mode=os.getenv('CHICORY_ANALYSIS_CACHE_KEY', 'content'),
+    enabled=os.getenv('CHICORY_ANALYSIS_CACHE', '1').lower() not in ('0', 'false', 'no')
+)
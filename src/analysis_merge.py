@@ -0,0 +1,213 @@
+import json
+import hashlib
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+# Records at the end of one viewport and the start of the next that may be the same item cut by the overlap
+BOUNDARY_RECORDS = 3
+# Text similarity above which a boundary pair that isn't clearly the same item is left for a caller to decide
+AMBIGUOUS_THRESHOLD = 0.6
+# Shortest text for which "one record's text starts or ends with the other's" counts as a cut-off match
+MIN_CONTAINED_LENGTH = 20
+
+SAME = "same"
+DIFFERENT = "different"
+UNSURE = "unsure"
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+def normalize(value: Any) -> Any:
+    """Case-fold and collapse whitespace so cosmetic differences between viewports don't matter"""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items() if not _is_empty(item)}
+    if isinstance(value, list):
+        return [normalize(item) for item in value if not _is_empty(item)]
+    return value
+
+def fingerprint(entry: Any) -> str:
+    """Hash of the normalized record, equal for exact duplicates"""
+    return hashlib.sha1(json.dumps(normalize(entry), sort_keys=True, default=str).encode()).hexdigest()
+
+def _flatten_text(value: Any) -> str:
+    if isinstance(value, dict):
+        return " ".join(_flatten_text(value[key]) for key in sorted(value))
+    if isinstance(value, list):
+        return " ".join(_flatten_text(item) for item in value)
+    return "" if value is None else str(value)
+
+def similarity(a: Any, b: Any) -> float:
+    """0.0-1.0 similarity of two records' normalized text, reported with unresolved pairs"""
+    text_a = _flatten_text(normalize(a))
+    text_b = _flatten_text(normalize(b))
+    if not text_a or not text_b:
+        return 0.0
+    matcher = SequenceMatcher(None, text_a, text_b, autojunk=False)
+    if matcher.quick_ratio() < AMBIGUOUS_THRESHOLD:
+        return matcher.quick_ratio()
+    return matcher.ratio()
+
+def _cut_off(shorter: str, longer: str) -> bool:
+    # Cut at the bottom edge keeps the start of the text, cut at the top keeps the end
+    return longer.startswith(shorter) or longer.endswith(shorter)
+
+def compare_records(a: Any, b: Any) -> str:
+    """SAME, DIFFERENT or UNSURE for two records seen either side of a viewport boundary.
+
+    Records are the same item when every field both have agrees, either
+    exactly or because one value is the other cut off at the viewport edge,
+    and the agreement isn't trivial (an equal field, or a cut-off of at least
+    MIN_CONTAINED_LENGTH characters). One field that disagrees outright
+    makes them different items, however similar the rest is: records built
+    from one template differ in just a title or a number.
+    """
+    a, b = normalize(a), normalize(b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        pairs = [(_flatten_text(a[key]), _flatten_text(b[key])) for key in a if key in b]
+    else:
+        pairs = [(_flatten_text(a), _flatten_text(b))]
+    pairs = [(value_a, value_b) for value_a, value_b in pairs if value_a and value_b]
+    if not pairs:
+        return UNSURE
+    evidence = False
+    for value_a, value_b in pairs:
+        if value_a == value_b:
+            evidence = True
+            continue
+        shorter, longer = sorted((value_a, value_b), key=len)
+        if not _cut_off(shorter, longer):
+            return DIFFERENT
+        evidence = evidence or len(shorter) >= MIN_CONTAINED_LENGTH
+    return SAME if evidence else UNSURE
+
+def merge_entries(a: Any, b: Any) -> Any:
+    """Combine two versions of one record, keeping the more complete value of each field"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = merge_entries(a[key], value) if key in a else value
+        return merged
+    if isinstance(a, list) and isinstance(b, list):
+        seen = {fingerprint(item) for item in a}
+        return a + [item for item in b if fingerprint(item) not in seen]
+    if isinstance(a, str) and isinstance(b, str):
+        return b if len(b.strip()) > len(a.strip()) else a
+    return b if _is_empty(a) else a
+
+def _collection_keys(schema: Any, analyses: List[dict]) -> List[str]:
+    """Keys holding lists of records: array fields of the extraction schema, then any list in the analyses"""
+    keys = []
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if isinstance(value, list) or (isinstance(value, dict) and value.get("type") == "array"):
+                keys.append(key)
+    for analysis in analyses:
+        for key, value in analysis.items():
+            if isinstance(value, list) and key not in keys:
+                keys.append(key)
+    return keys
+
+def merge_analyses(analyses: List[Any], extraction_schema: Any = None,
+                   boundary_records: int = BOUNDARY_RECORDS) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, int]]:
+    """Deterministically merge per-viewport analyses given in viewport order.
+
+    Records in list fields are deduplicated by normalized hash. Beyond that,
+    only the last boundary_records records of one viewport and the first
+    boundary_records of the next are compared, since an item split by the
+    overlap can only sit there; a pair is merged when compare_records finds
+    it the same item cut off at the edge. Boundary pairs it can't decide are
+    kept separate and returned as unresolved so a caller can decide them.
+
+    Returns (merged, unresolved, stats), where each unresolved item is
+    {"collection", "index_a", "index_b", "a", "b", "similarity"} with
+    indices into merged[collection].
+    """
+    # Models sometimes return a bare list of records; treat it as "content"
+    analyses = [a if isinstance(a, dict) else {"content": a} for a in analyses if isinstance(a, (dict, list))]
+    # Failed viewport analyses only carry an error and an empty content list
+    analyses = [{k: v for k, v in a.items() if k != "error"} for a in analyses]
+    collections = _collection_keys(extraction_schema, analyses)
+    merged: Dict[str, Any] = {key: [] for key in collections}
+    unresolved: List[Dict[str, Any]] = []
+    stats = {"viewports": len(analyses), "input_records": 0, "exact_duplicates": 0,
+             "fuzzy_merged": 0, "unresolved": 0}
+
+    for key in collections:
+        records: List[Any] = merged[key]
+        seen: Dict[str, int] = {}
+        previous: List[int] = []  # Indices into records of the previous viewport's records, in order
+        for analysis in analyses:
+            current: List[int] = []
+            entries = [entry for entry in analysis.get(key) or [] if not _is_empty(entry)]
+            for position, entry in enumerate(entries):
+                stats["input_records"] += 1
+                digest = fingerprint(entry)
+                if digest in seen:
+                    stats["exact_duplicates"] += 1
+                    current.append(seen[digest])
+                    continue
+
+                match, unsure = None, None
+                if position < boundary_records:
+                    for index in previous[-boundary_records:]:
+                        if index in current:
+                            continue
+                        verdict = compare_records(records[index], entry)
+                        if verdict == SAME:
+                            match = index
+                            break
+                        if verdict == UNSURE and unsure is None:
+                            unsure = index
+
+                if match is not None:
+                    records[match] = merge_entries(records[match], entry)
+                    seen[digest] = match
+                    seen[fingerprint(records[match])] = match
+                    current.append(match)
+                    stats["fuzzy_merged"] += 1
+                    continue
+
+                records.append(entry)
+                seen[digest] = len(records) - 1
+                current.append(len(records) - 1)
+                if unsure is not None:
+                    score = similarity(records[unsure], entry)
+                    if score >= AMBIGUOUS_THRESHOLD:
+                        unresolved.append({"collection": key, "index_a": unsure, "index_b": len(records) - 1,
+                                           "a": records[unsure], "b": entry, "similarity": round(score, 3)})
+            previous = current
+
+    # Everything that isn't a record list (page metadata, summaries) is merged field by field
+    for analysis in analyses:
+        for key, value in analysis.items():
+            if key in collections:
+                continue
+            merged[key] = merge_entries(merged[key], value) if key in merged else value
+
+    stats["unresolved"] = len(unresolved)
+    return merged, unresolved, stats
+
+def apply_resolutions(merged: Dict[str, Any], unresolved: List[Dict[str, Any]],
+                      decisions: Dict[int, Optional[Any]]) -> int:
+    """Apply decisions for unresolved pairs, keyed by position in unresolved.
+
+    A decision holds the combined record when the pair is the same item, or
+    None to keep both. Returns how many pairs were collapsed.
+    """
+    removals: Dict[str, set] = {}
+    collapsed = 0
+    for position, pair in enumerate(unresolved):
+        combined = decisions.get(position)
+        if combined is None:
+            continue
+        removed = removals.setdefault(pair["collection"], set())
+        if pair["index_a"] in removed or pair["index_b"] in removed:
+            continue
+        merged[pair["collection"]][pair["index_a"]] = combined
+        removed.add(pair["index_b"])
+        collapsed += 1
+    for key, removed in removals.items():
+        merged[key] = [record for index, record in enumerate(merged[key]) if index not in removed]
+    return collapsed
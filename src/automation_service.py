@@ -1,30 +1,108 @@
-from fastapi import FastAPI, HTTPException
+import time
+# Taken before the heavy imports so startup time covers them
+SERVICE_STARTED = time.monotonic()
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-import pyautogui
 import uvicorn
-from typing import Optional, List, Dict, Any
-import time
+from typing import Optional, List, Dict, Any, Callable
 import logging
-import subprocess
-import sys
 import os
 import asyncio
-from datetime import datetime
+from PIL import Image
+import numpy as np
 import json
-from google.cloud import aiplatform
-from vertexai.preview.generative_models import GenerativeModel, Part
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from model_client import model_registry, ImageData
+from model_calls import model_caller, model_limiter
+from analysis_cache import analysis_cache
+from frame_utils import to_gray_array, frames_identical, measure_vertical_shift, crop_new_strip
+from scroll_stepper import AdaptiveScrollStepper, MAX_OVERSHOOT_RETRIES
+from screen_capture import wait_until_stable, frame_cache
+from analysis_merge import merge_analyses, merge_entries, apply_resolutions
+from image_encoding import ImageInput, load_image_bytes
+from window_focus import focus_manager
+from input_dispatch import input_dispatcher
+import input_actions
+from input_actions import TimingProfile, TIMING_PROFILES
+from session_store import session_store
+from workflows import workflow_store, workflow_recorder, signature_difference, DEFAULT_MATCH_THRESHOLD
+from jobs import JobManager, JobQueueFull, Job, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+from metrics import metrics
 import base64
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure PyAutoGUI
-pyautogui.FAILSAFE = True  # Move mouse to corner to abort
-pyautogui.PAUSE = 0.1  # Add small delay between actions
-
 app = FastAPI()
 
+# Readiness of the lazily loaded subsystems: "loading", "ready" or "error: ..."
+subsystem_status = {"input": "loading", "capture": "loading", "model": "loading"}
+startup_time: Optional[float] = None
+
+# Model calls are blocking, so they run in a bounded worker pool off the event loop;
+# the adaptive limiter decides how many of them actually run at once
+ANALYSIS_WORKERS = int(os.getenv('CHICORY_ANALYSIS_WORKERS', str(model_limiter.max_limit)))
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+
+# Background scroll-and-capture sessions; one at a time by default since they drive the real mouse
+job_manager = JobManager(
+    max_concurrent=int(os.getenv('CHICORY_MAX_CONCURRENT_JOBS', '1')),
+    max_queued=int(os.getenv('CHICORY_MAX_QUEUED_JOBS', '16'))
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Per-endpoint latency histogram, request counts by status and the number of requests in flight"""
+    started = time.monotonic()
+    status = "500"
+    try:
+        with metrics.in_flight("chicory_http_requests_in_flight"):
+            response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # Label by route template so /jobs/{job_id} is one series, not one per job
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.observe("chicory_http_request_seconds", time.monotonic() - started, method=request.method, path=path)
+        metrics.inc("chicory_http_requests_total", method=request.method, path=path, status=status)
+
+def collect_service_metrics() -> Dict[str, float]:
+    """Gauges read from the caches, the input thread and the job queue at scrape time"""
+    cache = analysis_cache.stats()
+    screen = frame_cache.stats()
+    focus = focus_manager.stats()
+    capture_store = session_store.stats()
+    model_calls = model_limiter.stats()
+    jobs = job_manager.list()
+    focus_lookups = focus["focus_calls"] + focus["cache_hits"]
+    return {
+        "chicory_analysis_cache_hits": cache["hits"],
+        "chicory_analysis_cache_misses": cache["misses"],
+        "chicory_analysis_cache_hit_rate": cache["hit_rate"],
+        "chicory_analysis_cache_bytes": cache["size_bytes"],
+        "chicory_frame_cache_grabs": screen["grabs"],
+        "chicory_frame_cache_shared_hits": screen["shared_hits"],
+        "chicory_frame_cache_hit_rate": screen["hit_rate"],
+        "chicory_focus_calls": focus["focus_calls"],
+        "chicory_focus_cache_hit_rate": focus["cache_hits"] / focus_lookups if focus_lookups else 0.0,
+        "chicory_input_queue_depth": input_dispatcher.pending,
+        "chicory_model_concurrency_limit": model_calls["limit"],
+        "chicory_model_slots_in_use": model_calls["in_flight"],
+        "chicory_model_calls_waiting": model_calls["waiting"],
+        "chicory_model_limit_decreases": model_calls["decreases"],
+        "chicory_capture_store_bytes": capture_store["size_bytes"],
+        "chicory_capture_store_sessions": capture_store["sessions"],
+        "chicory_jobs_queued": sum(1 for job in jobs if job.status == QUEUED),
+        "chicory_jobs_running": sum(1 for job in jobs if job.status == RUNNING),
+        "chicory_uptime_seconds": time.monotonic() - SERVICE_STARTED
+    }
+
+metrics.add_collector(collect_service_metrics)
+
 class Point(BaseModel):
     x: int
     y: int
@@ -43,14 +121,18 @@ class ClickRequest(BaseModel):
     x: int
     y: int
     window_info: Optional[WindowInfo] = None
+    timing_profile: Optional[str] = None  # "human", "fast" or "instant"; defaults to the global profile
 
 class TypeRequest(BaseModel):
     text: str
     window_info: Optional[WindowInfo] = None
+    timing_profile: Optional[str] = None
+    text_entry: Optional[str] = None  # "type" or "paste"; defaults to the profile's paste threshold
 
 class KeyRequest(BaseModel):
     key: str
     window_info: Optional[WindowInfo] = None
+    timing_profile: Optional[str] = None
 
 class ScrollRequest(BaseModel):
     x: int
@@ -58,6 +140,8 @@ class ScrollRequest(BaseModel):
     direction: str  # "up", "down", "left", "right"
     window_info: Optional[WindowInfo] = None
     element_info: Optional[Dict[str, Any]] = None
+    settle_timeout: float = 2.0  # Max wait for the page to stop moving after the scroll
+    timing_profile: Optional[str] = None
 
 class Action(BaseModel):
     action: str
@@ -66,6 +150,20 @@ class Action(BaseModel):
     key_command: Optional[str] = None
     bbox: Optional[BoundingBox] = None
     window_info: Optional[WindowInfo] = None
+    timing_profile: Optional[str] = None
+    text_entry: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    actions: List[Action]
+    window_info: Optional[WindowInfo] = None  # Default target for actions without their own window_info
+    stop_on_error: bool = True  # Skip the remaining actions after a failure instead of continuing
+    timing_profile: Optional[str] = None  # Default for actions without their own profile
+
+class ImageEncoding(BaseModel):
+    format: str = "PNG"  # "PNG", "JPEG" or "WEBP"
+    quality: int = 85  # JPEG/WebP quality
+    compress_level: int = 1  # PNG compression, 0-9; low favours speed over size
+    max_dimension: Optional[int] = None  # Downscale so neither side exceeds this
 
 class ScrollAndCaptureRequest(BaseModel):
     x: int
@@ -73,41 +171,77 @@ class ScrollAndCaptureRequest(BaseModel):
     window_info: Optional[WindowInfo] = None
     goal: Optional[str] = None  # Made optional
     element_info: Optional[Dict[str, Any]] = None
+    timing_profile: Optional[str] = None
+    pipelined: bool = True  # Keep capturing while earlier viewports are analyzed
+    use_cache: bool = True  # Reuse cached analyses of identical viewports
+    max_concurrent_analyses: Optional[int] = None  # Defaults to ANALYSIS_WORKERS
+    max_viewports: int = 5  # Ceiling only; capture stops when the page stops scrolling
+    end_of_content_threshold: float = 0.002  # Mean frame difference treated as "did not move"
+    end_of_content_frames: int = 2  # Consecutive unchanged frames before stopping; 1 lets a late repaint end the capture
+    overlap_pixels: Optional[int] = None  # Overlap kept between viewports; defaults to 10% of the height
+    pixels_per_scroll_unit: Optional[float] = None  # Skip calibration when the scroll ratio is known
+    settle_timeout: float = 2.0  # Max wait for the page to settle after each scroll
+    analysis_batch_size: int = 1  # Viewports packed into each model call; 1 sends one call per viewport
+    merge_with_model_fallback: bool = False  # Ask the model about records the local merger can't resolve
+    send_new_strips_only: bool = False  # Send only content revealed by each scroll instead of full frames
+    strip_context_pixels: int = 40  # Already-seen pixels kept above each strip for context
+    encoding: ImageEncoding = ImageEncoding()  # How images are encoded for the model
+    save_screenshots: bool = True  # Also write screenshots to the capture dir in the background
 
-def focus_window_macos(process_id: int) -> bool:
-    """Focus a window on macOS using AppleScript"""
-    try:
-        script = f'''
-        tell application "System Events"
-            set frontmost of the first process whose unix id is {process_id} to true
-        end tell
-        '''
-        subprocess.run(['osascript', '-e', script], check=True)
-        # Small delay to ensure window is focused
-        time.sleep(0.2)
-        return True
-    except Exception as e:
-        logger.error(f"Error focusing window: {e}")
-        return False
+def window_region(window_info: Optional[WindowInfo]) -> Optional[tuple]:
+    """Screen region (x, y, width, height) covered by the window, if its bounds are known"""
+    if not window_info or not window_info.bounds:
+        return None
+    bounds = window_info.bounds
+    if not bounds.get('width') or not bounds.get('height'):
+        return None
+    return (bounds.get('x', 0), bounds.get('y', 0), bounds['width'], bounds['height'])
 
-async def ensure_window_focused(window_info: Optional[WindowInfo]) -> bool:
-    """Ensure the target window is focused before performing actions"""
+def focus_window(window_info: Optional[WindowInfo]) -> bool:
+    """Focus the target window; runs on the input thread"""
     if not window_info or not window_info.owner:
         return False
         
-    if sys.platform == 'darwin':
-        process_id = window_info.owner.get('processId')
-        if process_id:
-            return focus_window_macos(process_id)
-    
-    return False
+    process_id = window_info.owner.get('processId')
+    if not process_id:
+        return False
+    with metrics.stage("focus"):
+        return focus_manager.ensure_focused(process_id)
+
+def _run_focused(window_info: Optional[WindowInfo], fn: Callable, *args, **kwargs):
+    if window_info:
+        focus_window(window_info)
+    return fn(*args, **kwargs)
+
+async def run_input(window_info: Optional[WindowInfo], fn: Callable, *args, **kwargs):
+    """Focus the window and run fn as one command on the input thread, so no other request's events interleave"""
+    return await input_dispatcher.run(_run_focused, window_info, fn, *args, **kwargs)
+
+class TimingProfileRequest(BaseModel):
+    name: str
+
+def resolve_profile(name: Optional[str]) -> TimingProfile:
+    """Timing profile for a request, rejecting unknown names with a 400"""
+    try:
+        return input_actions.get_profile(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/input/timing_profile")
+async def get_timing_profile():
+    return {"default": input_actions.get_profile().name, "profiles": {name: vars(p) for name, p in TIMING_PROFILES.items()}}
+
+@app.post("/input/timing_profile")
+async def set_timing_profile(request: TimingProfileRequest):
+    resolve_profile(request.name)
+    input_actions.set_default_profile(request.name)
+    return {"success": True, "default": request.name}
 
 @app.post("/mouse/move")
 async def move_mouse(request: ClickRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
-        pyautogui.moveTo(request.x, request.y, duration=0.2)  # Smooth movement
+        await run_input(request.window_info, input_actions.move_to, request.x, request.y, profile)
         return {"success": True}
     except Exception as e:
         logger.error(f"Error moving mouse: {e}")
@@ -115,14 +249,11 @@ async def move_mouse(request: ClickRequest):
 
 @app.post("/mouse/click")
 async def click_mouse(request: ClickRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
         logger.info(f"Click request at ({request.x}, {request.y})")
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
-        # First move to position
-        pyautogui.moveTo(request.x, request.y, duration=0.2)
-        # Then click
-        pyautogui.click()
+        # Move to position, then click
+        await run_input(request.window_info, input_actions.click, request.x, request.y, profile)
         return {"success": True}
     except Exception as e:
         logger.error(f"Error clicking: {e}")
@@ -130,14 +261,11 @@ async def click_mouse(request: ClickRequest):
 
 @app.post("/mouse/right_click")
 async def right_click_mouse(request: ClickRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
         logger.info(f"Right click request at ({request.x}, {request.y})")
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
-        # First move to position
-        pyautogui.moveTo(request.x, request.y, duration=0.2)
-        # Then right click
-        pyautogui.rightClick()
+        # Move to position, then right click
+        await run_input(request.window_info, input_actions.click, request.x, request.y, profile, button='right')
         return {"success": True}
     except Exception as e:
         logger.error(f"Error right clicking: {e}")
@@ -145,10 +273,9 @@ async def right_click_mouse(request: ClickRequest):
 
 @app.post("/keyboard/type")
 async def type_text(request: TypeRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
-        pyautogui.typewrite(request.text)
+        await run_input(request.window_info, input_actions.type_text, request.text, profile, request.text_entry)
         return {"success": True}
     except Exception as e:
         logger.error(f"Error typing: {e}")
@@ -156,109 +283,351 @@ async def type_text(request: TypeRequest):
 
 @app.post("/keyboard/key")
 async def press_key(request: KeyRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
         key = request.key.lower()
         if key in ["enter", "tab", "escape"]:
-            pyautogui.press(key)
+            await run_input(request.window_info, input_actions.press_key, key, profile)
         return {"success": True}
     except Exception as e:
         logger.error(f"Error pressing key: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def scroll_in_chunks(x: int, y: int, direction: str, profile: TimingProfile):
+    """Move to the point and scroll one step in direction; runs on the input thread"""
+    # Move to position first
+    input_actions.move_to(x, y, profile)
+    
+    # Convert direction to scroll amount
+    # Positive numbers scroll up, negative numbers scroll down
+    # We use smaller scroll amounts to match scroll_and_capture behavior
+    scroll_amount = {
+        "up": 25,
+        "down": -25,
+        "left": -15,
+        "right": 15
+    }.get(direction.lower(), -25)  # Default to scroll down
+    
+    # Perform scroll in smaller chunks for smoothness
+    remaining_scroll = abs(scroll_amount)
+    scroll_direction = 1 if scroll_amount > 0 else -1
+    
+    while remaining_scroll > 0:
+        # Scroll in tiny chunks of 15 pixels or less
+        scroll_chunk = min(15, remaining_scroll)
+        horizontal = direction.lower() not in ["up", "down"]
+        input_actions.scroll(scroll_chunk * scroll_direction, profile, horizontal)
+        remaining_scroll -= scroll_chunk
+
 @app.post("/mouse/scroll")
 async def scroll_mouse(request: ScrollRequest):
+    profile = resolve_profile(request.timing_profile)
     try:
         logger.info(f"Scroll request at ({request.x}, {request.y}) direction: {request.direction}")
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
-        
-        # Move to position first
-        pyautogui.moveTo(request.x, request.y, duration=0.2)
-        
-        # Convert direction to scroll amount
-        # Positive numbers scroll up, negative numbers scroll down
-        # We use smaller scroll amounts to match scroll_and_capture behavior
-        scroll_amount = {
-            "up": 25,
-            "down": -25,
-            "left": -15,
-            "right": 15
-        }.get(request.direction.lower(), -25)  # Default to scroll down
-        
-        # Perform scroll in smaller chunks for smoothness
-        remaining_scroll = abs(scroll_amount)
-        scroll_direction = 1 if scroll_amount > 0 else -1
-        
-        while remaining_scroll > 0:
-            # Scroll in tiny chunks of 15 pixels or less
-            scroll_chunk = min(15, remaining_scroll)
-            if request.direction.lower() in ["up", "down"]:
-                pyautogui.scroll(scroll_chunk * scroll_direction)
-            else:
-                pyautogui.hscroll(scroll_chunk * scroll_direction)
-            remaining_scroll -= scroll_chunk
-            time.sleep(0.3)  # Small delay between chunks
+        region = window_region(request.window_info)
+        before, _ = await frame_cache.capture(region, max_age=0.05)
+        await run_input(request.window_info, scroll_in_chunks, request.x, request.y, request.direction, profile)
         
-        return {"success": True}
+        # Return as soon as the window stops moving instead of sleeping a fixed time
+        settle = await wait_until_stable(region, timeout=request.settle_timeout, reference=before)
+        return {"success": True, "settled": settle.stable, "settle_time": round(settle.elapsed, 3)}
     except Exception as e:
         logger.error(f"Error scrolling: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def perform_action(action: Action, profile: TimingProfile):
+    """Run one action's input events; window focus is the caller's job"""
+    if action.action.lower() == "click" and action.bbox:
+        # Calculate center of bounding box
+        center_x = action.bbox.x + (action.bbox.width // 2)
+        center_y = action.bbox.y + (action.bbox.height // 2)
+        
+        logger.info(f"Executing click at ({center_x}, {center_y})")
+        # Move and click
+        input_actions.click(center_x, center_y, profile)
+        
+    elif action.action.lower() == "type":
+        if action.input_text:
+            input_actions.type_text(action.input_text, profile, action.text_entry)
+            
+        if action.key_command:
+            key = action.key_command.lower()
+            if key in ["enter", "tab", "escape"]:
+                input_actions.press_key(key, profile)
+                
+    elif action.action.lower() == "keyboard":
+        if action.key_command:
+            key = action.key_command.lower()
+            if key in ["enter", "tab", "escape"]:
+                input_actions.press_key(key, profile)
+
+def recordable_action(action: Action) -> dict:
+    """What a workflow keeps of an action; window and pacing are recorded or chosen separately"""
+    return action.dict(exclude={"window_info", "timing_profile"})
+
 @app.post("/execute")
 async def execute_action(action: Action):
+    profile = resolve_profile(action.timing_profile)
     try:
-        if action.window_info:
-            await ensure_window_focused(action.window_info)
-            
-        if action.action.lower() == "click" and action.bbox:
-            # Calculate center of bounding box
-            center_x = action.bbox.x + (action.bbox.width // 2)
-            center_y = action.bbox.y + (action.bbox.height // 2)
-            
-            logger.info(f"Executing click at ({center_x}, {center_y})")
-            # Move and click
-            pyautogui.moveTo(center_x, center_y, duration=0.2)
-            pyautogui.click()
-            
-        elif action.action.lower() == "type":
-            if action.input_text:
-                pyautogui.typewrite(action.input_text)
-                
-            if action.key_command:
-                key = action.key_command.lower()
-                if key in ["enter", "tab", "escape"]:
-                    pyautogui.press(key)
-                    
-        elif action.action.lower() == "keyboard":
-            if action.key_command:
-                key = action.key_command.lower()
-                if key in ["enter", "tab", "escape"]:
-                    pyautogui.press(key)
-                    
+        recording = workflow_recorder.active
+        region = window_region(action.window_info)
+        reference = await workflow_recorder.snapshot(region) if recording else None
+        started = time.monotonic()
+        await run_input(action.window_info, perform_action, action, profile)
+        if recording:
+            workflow_recorder.record(recordable_action(action), action.window_info.dict() if action.window_info else None,
+                                     region, reference, started, time.monotonic() - started)
         return {"success": True}
     except Exception as e:
         logger.error(f"Error executing action: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def window_process_id(window_info: Optional[WindowInfo]) -> Optional[int]:
+    if not window_info or not window_info.owner:
+        return None
+    return window_info.owner.get('processId')
+
+def run_batch_steps(request: BatchRequest, profiles: List[TimingProfile], record_references: bool = False) -> tuple:
+    """Run a batch's actions on the input thread.
+
+    Returns (per-step results, whether any step failed, reference frames by
+    step index). References are only grabbed when record_references is set,
+    just before each step, since the batch holds the input thread throughout.
+    """
+    results = []
+    references: Dict[int, Optional[tuple]] = {}
+    focused_pid = None
+    default_window = request.window_info or next((a.window_info for a in request.actions if a.window_info), None)
+    failed = False
+    
+    for index, action in enumerate(request.actions):
+        if failed and request.stop_on_error:
+            results.append({"index": index, "action": action.action, "status": "skipped"})
+            continue
+        
+        window_info = action.window_info or default_window
+        if record_references:
+            references[index] = workflow_recorder.snapshot_now(window_region(window_info))
+        step_started = time.monotonic()
+        try:
+            # Only refocus when a step targets a different window than the one already focused
+            pid = window_process_id(window_info)
+            if pid is not None and pid != focused_pid:
+                focus_window(window_info)
+                focused_pid = pid
+            perform_action(action, profiles[index])
+            results.append({"index": index, "action": action.action, "status": "ok",
+                            "elapsed": round(time.monotonic() - step_started, 4)})
+        except Exception as e:
+            logger.error(f"Error executing batch step {index} ({action.action}): {e}")
+            failed = True
+            results.append({"index": index, "action": action.action, "status": "error", "error": str(e),
+                            "elapsed": round(time.monotonic() - step_started, 4)})
+    return results, failed, references
+
+@app.post("/execute/batch")
+async def execute_batch(request: BatchRequest):
+    """Run actions back-to-back, focusing the target window once instead of per action"""
+    started = time.monotonic()
+    profiles = [resolve_profile(action.timing_profile or request.timing_profile) for action in request.actions]
+    default_window = request.window_info or next((a.window_info for a in request.actions if a.window_info), None)
+    recording = workflow_recorder.active
+    try:
+        # The whole batch is one input command, so other requests can't interleave with it
+        results, failed, references = await input_dispatcher.run(
+            run_batch_steps, request, profiles, recording,
+            timeout=input_dispatcher.default_timeout * max(1, len(request.actions)))
+    except Exception as e:
+        logger.error(f"Error executing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if recording:
+        step_started = started
+        for result in results:
+            if result["status"] != "ok":
+                break
+            action = request.actions[result["index"]]
+            window_info = action.window_info or default_window
+            workflow_recorder.record(recordable_action(action), window_info.dict() if window_info else None,
+                                     window_region(window_info), references.get(result["index"]),
+                                     step_started, result["elapsed"])
+            step_started += result["elapsed"]
+    
+    return {
+        "success": not failed,
+        "results": results,
+        "total_time": round(time.monotonic() - started, 4)
+    }
+
+async def prepare_image(image: ImageInput, encoding: Optional[dict] = None) -> tuple:
+    """Encode an image for the model off the event loop, returning (bytes, mime type)"""
+    loop = asyncio.get_running_loop()
+    with metrics.stage("encode"):
+        return await loop.run_in_executor(None, functools.partial(load_image_bytes, image, **(encoding or {})))
+
+async def generate_json_async(contents, call: str = "other") -> Any:
+    """JSON-constrained call to the shared model, returning the parsed answer.
+
+    call names the kind of request ("initial", "schema", "batch", "merge", "replay") in metrics.
+    The model is resolved and image parts are built on the analysis executor, off the event loop.
+    Raises ModelCallError once retries or the deadline run out.
+    """
+    return await model_caller.call_json(analysis_executor, None, contents, call=call)
+
+@app.on_event("startup")
+async def start_input_dispatcher():
+    input_dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_input_dispatcher():
+    input_dispatcher.stop()
+
+async def load_subsystems():
+    """Load pyautogui, the screen grabber and the Vertex AI SDK after the server is already answering"""
+    async def load_input():
+        try:
+            await input_dispatcher.run(input_actions.load_pyautogui)
+            subsystem_status["input"] = "ready"
+        except Exception as e:
+            logger.error(f"Input subsystem failed to load: {e}")
+            subsystem_status["input"] = f"error: {e}"
+            subsystem_status["capture"] = "error: input unavailable"
+            return
+        try:
+            await frame_cache.frame(max_age=0)
+            subsystem_status["capture"] = "ready"
+        except Exception as e:
+            logger.error(f"Capture subsystem failed to load: {e}")
+            subsystem_status["capture"] = f"error: {e}"
+    
+    async def load_model():
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(analysis_executor, model_registry.load)
+            subsystem_status["model"] = "ready"
+            # Optionally build the shared model and make a warm-up call
+            if os.getenv('CHICORY_MODEL_WARMUP', '').lower() in ('1', 'true', 'yes'):
+                await loop.run_in_executor(analysis_executor, model_registry.warm_up)
+        except Exception as e:
+            logger.error(f"Model subsystem failed to load: {e}")
+            subsystem_status["model"] = f"error: {e}"
+    
+    await asyncio.gather(load_input(), load_model())
+
+@app.on_event("startup")
+async def start_background_loading():
+    global startup_time
+    startup_time = time.monotonic() - SERVICE_STARTED
+    logger.info(f"Service started in {startup_time:.3f}s; loading subsystems in the background")
+    # Keep a reference so the task is not garbage collected mid-flight
+    app.state.subsystem_loader = asyncio.create_task(load_subsystems())
+
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "ready": all(status == "ready" for status in subsystem_status.values()),
+        "subsystems": subsystem_status,
+        "startup_time": round(startup_time, 4) if startup_time is not None else None,
+        "uptime": round(time.monotonic() - SERVICE_STARTED, 1)
+    }
+
+@app.get("/screen/capture")
+async def capture_screen(x: Optional[int] = None, y: Optional[int] = None, width: Optional[int] = None,
+                         height: Optional[int] = None, max_age: Optional[float] = None,
+                         format: str = "PNG", quality: int = 85):
+    """Current screen (or a region of it), served from the shared frame cache when fresh enough"""
+    region = None
+    if None not in (x, y, width, height):
+        region = (x, y, width, height)
+    try:
+        pixels, frame = await frame_cache.capture(region, max_age)
+        if pixels.size == 0:
+            raise HTTPException(status_code=400, detail="Region is outside the screen")
+        content, mime_type = await prepare_image(Image.fromarray(pixels), {"format": format, "quality": quality})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error capturing screen: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=content, media_type=mime_type, headers={
+        "X-Frame-Age": f"{frame.age:.4f}",
+        "X-Frame-Scale": f"{frame.scale:.2f}"
+    })
+
+@app.get("/screen/stats")
+async def screen_stats():
+    return frame_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """Request latencies, per-stage timings, model payload sizes, cache hit rates and in-flight counts.
+
+    Prometheus text by default; format=json returns the same data as JSON.
+    """
+    if format == "json":
+        return metrics.to_dict()
+    if format != "prometheus":
+        raise HTTPException(status_code=400, detail=f"Unknown metrics format: {format}")
+    return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/focus/stats")
+async def focus_stats():
+    return focus_manager.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return analysis_cache.stats()
+
+@app.post("/cache/clear")
+async def clear_cache():
+    analysis_cache.clear()
+    return {"success": True}
+
+def open_capture_session(session_id: str):
+    try:
+        return session_store.open(session_id)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"Unknown capture session: {session_id}")
 
-async def analyze_initial_screenshot(image_path: str, goal: str) -> dict:
+@app.get("/captures")
+async def list_capture_sessions():
+    return {"sessions": session_store.list(), "stats": session_store.stats()}
+
+@app.get("/captures/{session_id}")
+async def get_capture_session(session_id: str):
+    """A session's JSON documents and the names of its screenshots"""
+    def read():
+        with open_capture_session(session_id) as reader:
+            return {
+                "session_id": reader.id,
+                "images": reader.image_names,
+                **{name: reader.document(name) for name in reader.document_names}
+            }
+    return await asyncio.get_running_loop().run_in_executor(None, read)
+
+@app.get("/captures/{session_id}/viewports/{index}")
+async def get_capture_viewport(session_id: str, index: int):
+    """One viewport's screenshot, read from the container without loading the rest"""
+    def read():
+        with open_capture_session(session_id) as reader:
+            try:
+                return reader.image_bytes(f"viewport_{index}")
+            except KeyError:
+                raise HTTPException(status_code=404, detail=f"Session {session_id} has no viewport {index}")
+    return Response(content=await asyncio.get_running_loop().run_in_executor(None, read), media_type="image/png")
+
+async def analyze_initial_screenshot(image: ImageInput, goal: str, use_cache: bool = True,
+                                     encoding: Optional[dict] = None) -> dict:
     """First stage: Analyze initial screenshot to determine content type and create extraction schema"""
     try:
-        # Initialize Vertex AI
-        aiplatform.init(project=os.getenv('GOOGLE_CLOUD_PROJECT'))
-        model = GenerativeModel('gemini-1.5-flash-001')
-        
-        # Read the image
-        with open(image_path, 'rb') as img_file:
-            image_bytes = img_file.read()
+        # Accepts a path, encoded bytes or an in-memory screenshot
+        image_bytes, mime_type = await prepare_image(image, encoding)
         
-        # Create image part
-        image_part = Part.from_data(data=base64.b64encode(image_bytes).decode(), mime_type="image/png")
+        # Turned into an SDK image part on the thread that makes the call
+        image_part = ImageData(base64.b64encode(image_bytes).decode(), mime_type)
         
         # Initial analysis prompt
         prompt = f"""
@@ -286,21 +655,18 @@ async def analyze_initial_screenshot(image_path: str, goal: str) -> dict:
         Include instructions for handling partial content that may span multiple screenshots.
         """
         
-        # Generate response
-        response = model.generate_content([prompt, image_part])
+        # Identical screenshot and prompt: skip the model call entirely
+        cache_key = analysis_cache.make_key(image_bytes, prompt) if use_cache else None
+        if cache_key:
+            cached = analysis_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # Parse and clean the response
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text.strip()
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start >= 0 and end > start:
-                result = json.loads(text[start:end])
-            else:
-                raise ValueError("Could not parse Gemini response as JSON")
-                
+        # JSON-constrained response, parsed (and retried if malformed) by the model-call layer
+        result = await generate_json_async([prompt, image_part], call="initial")
+        
+        if cache_key:
+            analysis_cache.put(cache_key, result)
         return result
         
     except Exception as e:
@@ -314,22 +680,9 @@ async def analyze_initial_screenshot(image_path: str, goal: str) -> dict:
             "initial_analysis": {}
         }
 
-async def analyze_screenshot_with_schema(image_path: str, extraction_context: dict) -> dict:
-    """Second stage: Analyze screenshot using the established schema"""
-    try:
-        # Initialize Vertex AI
-        aiplatform.init(project=os.getenv('GOOGLE_CLOUD_PROJECT'))
-        model = GenerativeModel('gemini-1.5-flash-001')
-        
-        # Read the image
-        with open(image_path, 'rb') as img_file:
-            image_bytes = img_file.read()
-        
-        # Create image part
-        image_part = Part.from_data(data=base64.b64encode(image_bytes).decode(), mime_type="image/png")
-        
-        # Use the extraction prompt from initial analysis
-        prompt = f"""
+def build_schema_prompt(extraction_context: dict, is_strip: bool = False) -> str:
+    """Prompt for analyzing one screenshot with the schema from the initial analysis"""
+    prompt = f"""
         {extraction_context['extraction_prompt']}
         
         Content Type: {extraction_context['content_type']}
@@ -346,22 +699,39 @@ async def analyze_screenshot_with_schema(image_path: str, extraction_context: di
         3. Preserve exact text and numbers
         4. Include all relevant metadata
         """
+    if is_strip:
+        prompt += """
+        This image is only the part of the page newly revealed by scrolling. The top few
+        lines repeat the end of the previous screenshot for context; extract items that
+        continue from there, but don't re-extract items that lie entirely within them.
+        """
+    return prompt
+
+async def analyze_screenshot_with_schema(image: ImageInput, extraction_context: dict, use_cache: bool = True,
+                                         is_strip: bool = False, encoding: Optional[dict] = None) -> dict:
+    """Second stage: Analyze screenshot using the established schema"""
+    try:
+        # Accepts a path, encoded bytes or an in-memory screenshot
+        image_bytes, mime_type = await prepare_image(image, encoding)
         
-        # Generate response
-        response = model.generate_content([prompt, image_part])
+        # Turned into an SDK image part on the thread that makes the call
+        image_part = ImageData(base64.b64encode(image_bytes).decode(), mime_type)
         
-        # Parse and clean the response
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text.strip()
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start >= 0 and end > start:
-                result = json.loads(text[start:end])
-            else:
-                raise ValueError("Could not parse Gemini response as JSON")
-                
+        # Use the extraction prompt from initial analysis
+        prompt = build_schema_prompt(extraction_context, is_strip)
+        
+        # Identical screenshot, prompt and schema: skip the model call entirely
+        cache_key = analysis_cache.make_key(image_bytes, prompt, extraction_context['extraction_schema']) if use_cache else None
+        if cache_key:
+            cached = analysis_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        # JSON-constrained response, parsed (and retried if malformed) by the model-call layer
+        result = await generate_json_async([prompt, image_part], call="schema")
+        
+        if cache_key:
+            analysis_cache.put(cache_key, result)
         return result
         
     except Exception as e:
@@ -371,6 +741,59 @@ async def analyze_screenshot_with_schema(image_path: str, extraction_context: di
             "content": []
         }
 
+async def analyze_screenshots_batch(images: List[ImageInput], extraction_context: dict, use_cache: bool = True,
+                                    strip_flags: Optional[List[bool]] = None,
+                                    encoding: Optional[dict] = None) -> List[dict]:
+    """Second stage, batched: analyze several screenshots (in order) with one model call"""
+    strip_flags = strip_flags or [False] * len(images)
+    results: List[Optional[dict]] = [None] * len(images)
+    try:
+        prepared = await asyncio.gather(*(prepare_image(image, encoding) for image in images))
+        
+        # Cache keys match single-screenshot analyses, so either mode reuses the other's results
+        cache_keys = [None] * len(images)
+        pending = []
+        for position, (image_bytes, mime_type) in enumerate(prepared):
+            if use_cache:
+                cache_keys[position] = analysis_cache.make_key(
+                    image_bytes, build_schema_prompt(extraction_context, strip_flags[position]),
+                    extraction_context['extraction_schema'])
+                cached = analysis_cache.get(cache_keys[position])
+                if cached is not None:
+                    results[position] = cached
+                    continue
+            pending.append(position)
+        
+        if pending:
+            prompt = build_schema_prompt(extraction_context) + f"""
+        You are given {len(pending)} screenshots of consecutive, overlapping parts of the same page,
+        labelled "Screenshot 0" to "Screenshot {len(pending) - 1}" in scroll order. Analyze each one
+        separately. Screenshots marked as strips show only content newly revealed by scrolling.
+        
+        Return a JSON object keyed by screenshot number, each value being that screenshot's analysis:
+        {{"0": {{ /* analysis following the schema */ }}, "1": {{ ... }}}}
+        """
+            contents = [prompt]
+            for label, position in enumerate(pending):
+                image_bytes, mime_type = prepared[position]
+                contents.append(f"Screenshot {label}{' (strip)' if strip_flags[position] else ''}:")
+                contents.append(ImageData(base64.b64encode(image_bytes).decode(), mime_type))
+            
+            batch_result = await generate_json_async(contents, call="batch")
+            
+            for label, position in enumerate(pending):
+                analysis = batch_result.get(str(label)) if isinstance(batch_result, dict) else None
+                if not isinstance(analysis, dict):
+                    results[position] = {"error": f"No analysis returned for screenshot {label}", "content": []}
+                    continue
+                results[position] = analysis
+                if cache_keys[position]:
+                    analysis_cache.put(cache_keys[position], analysis)
+    except Exception as e:
+        logger.error(f"Error analyzing screenshot batch with schema: {e}")
+        results = [result or {"error": str(e), "content": []} for result in results]
+    return results
+
 async def infer_goal_from_context(window_info: Optional[WindowInfo], element_info: Optional[Dict[str, Any]]) -> str:
     """Infer the analysis goal from window and element context"""
     if not window_info:
@@ -394,60 +817,53 @@ async def infer_goal_from_context(window_info: Optional[WindowInfo], element_inf
             
     return "Extract visible content and structure"
 
-async def merge_and_deduplicate_analyses(capture_dir: str, extraction_context: dict) -> dict:
-    """Final stage: Merge and deduplicate all analysis JSONs using Gemini"""
-    try:
-        # Initialize Vertex AI
-        aiplatform.init(project=os.getenv('GOOGLE_CLOUD_PROJECT'))
-        model = GenerativeModel('gemini-1.5-flash-001')
-        
-        # Collect all analysis JSONs
-        analyses = []
-        for filename in sorted(os.listdir(capture_dir)):
-            if filename.endswith('_analysis.json'):
-                with open(os.path.join(capture_dir, filename), 'r') as f:
-                    analyses.append(json.load(f))
-        
-        # Create merge prompt
-        prompt = f"""
-        Merge and deduplicate content from multiple screenshot analyses.
-        
+async def resolve_merge_conflicts_with_model(unresolved: List[dict], extraction_context: dict) -> Dict[int, Any]:
+    """Ask Gemini only about record pairs the local merger couldn't decide"""
+    pairs = [{"pair": position, "a": item["a"], "b": item["b"]} for position, item in enumerate(unresolved)]
+    prompt = f"""
         Content Type: {extraction_context['content_type']}
         Schema: {json.dumps(extraction_context['extraction_schema'], indent=2)}
         
-        Input analyses from {len(analyses)} screenshots:
-        {json.dumps(analyses, indent=2)}
+        Each pair below holds two records extracted from consecutive, overlapping screenshots.
+        Decide for each pair whether both records describe the same item (for example one
+        record was cut off at the edge of a screenshot).
         
-        Tasks:
-        1. Merge all content following the original schema
-        2. Remove duplicate entries
-        3. Handle content that spans multiple screenshots
-        4. Preserve all unique metadata and metrics
-        5. Maintain chronological order of content
+        Pairs:
+        {json.dumps(pairs, indent=2)}
         
-        Return a single JSON object containing all unique content and metadata.
+        Return a JSON object:
+        {{
+            "decisions": [
+                {{"pair": 0, "same": true, "merged": {{ /* combined record following the schema */ }}}},
+                {{"pair": 1, "same": false}}
+            ]
+        }}
         """
+    result = await generate_json_async(prompt, call="merge")
+    
+    decisions = {}
+    for decision in result.get("decisions", []):
+        position = decision.get("pair")
+        if decision.get("same") and isinstance(position, int) and 0 <= position < len(unresolved):
+            decisions[position] = decision.get("merged") or merge_entries(unresolved[position]["a"], unresolved[position]["b"])
+    return decisions
+
+async def merge_and_deduplicate_analyses(analyses: List[Any], extraction_context: dict,
+                                         use_model_fallback: bool = False) -> dict:
+    """Final stage: Merge and deduplicate per-viewport analyses (in viewport order) locally"""
+    try:
+        merged, unresolved, stats = merge_analyses(analyses, extraction_context.get('extraction_schema'))
         
-        # Generate response
-        response = model.generate_content(prompt)
-        
-        # Parse and clean the response
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text.strip()
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start >= 0 and end > start:
-                result = json.loads(text[start:end])
-            else:
-                raise ValueError("Could not parse Gemini response as JSON")
-        
-        # Save merged result
-        with open(os.path.join(capture_dir, "merged_analysis.json"), 'w') as f:
-            json.dump(result, f, indent=2)
-            
-        return result
+        # The model is only consulted for the few pairs the local merger can't decide
+        if unresolved and use_model_fallback:
+            try:
+                decisions = await resolve_merge_conflicts_with_model(unresolved, extraction_context)
+                stats["model_collapsed"] = apply_resolutions(merged, unresolved, decisions)
+                stats["unresolved"] = 0
+            except Exception as e:
+                logger.error(f"Model merge fallback failed, keeping unresolved records separate: {e}")
+        logger.info(f"Merge stats: {stats}")
+        return merged
         
     except Exception as e:
         logger.error(f"Error merging analyses: {e}")
@@ -456,121 +872,564 @@ async def merge_and_deduplicate_analyses(capture_dir: str, extraction_context: d
             "content": []
         }
 
-@app.post("/mouse/scroll_and_capture")
-async def scroll_and_capture(request: ScrollAndCaptureRequest):
+def scroll_down_units(units: int, profile: TimingProfile, up: bool = False):
+    """Scroll down (or up) by units in chunks of at most 15; runs on the input thread"""
+    remaining_scroll = units
+    while remaining_scroll > 0:
+        scroll_chunk = min(15, remaining_scroll)
+        input_actions.scroll(scroll_chunk if up else -scroll_chunk, profile)
+        remaining_scroll -= scroll_chunk
+
+async def run_scroll_and_capture(request: ScrollAndCaptureRequest,
+                                 emit: Optional[Callable[[str, dict], None]] = None) -> dict:
+    """Scroll through the window capturing and analyzing viewports, then merge the results.
+
+    emit(event, data) is called as the session progresses: "started",
+    "viewport_captured", "extraction_context", "viewport_analysis",
+    "capture_complete" and "merged".
+
+    Viewports whose analysis failed even after retries are listed in
+    failed_viewports rather than merged as empty. Without the initial
+    analysis there is no schema to analyze the rest with, so their model
+    calls are skipped and the result reports success: False.
+    """
+    emit = emit or (lambda event, data: None)
+    
+    # Infer goal if not provided
+    if not request.goal:
+        request.goal = await infer_goal_from_context(request.window_info, request.element_info)
+        
+    logger.info(f"Scroll and capture request at ({request.x}, {request.y}) with goal: {request.goal}")
+    
+    # Focus and move to position first
+    profile = resolve_profile(request.timing_profile)
+    await run_input(request.window_info, input_actions.move_to, request.x, request.y, profile)
+    
+    # Everything from this session goes into one container with a unique id
+    session = session_store.create()
+    session.put_json("request", request.dict())
+    emit("started", {"session_id": session.id, "goal": request.goal})
+    
+    # Get the window bounds
+    if not request.window_info or not request.window_info.bounds:
+        raise HTTPException(status_code=400, detail="Window bounds not provided")
+        
+    bounds = request.window_info.bounds
+    viewport_width = bounds.get('width', 0)
+    viewport_height = bounds.get('height', 0)
+    window_x = bounds.get('x', 0)
+    window_y = bounds.get('y', 0)
+    
+    if viewport_width == 0 or viewport_height == 0:
+        raise HTTPException(status_code=400, detail="Invalid window dimensions")
+    
+    # Size each scroll from the viewport, keeping enough overlap to register consecutive frames
+    overlap_pixels = request.overlap_pixels if request.overlap_pixels is not None else max(40, viewport_height // 10)
+    stepper = AdaptiveScrollStepper(viewport_height, overlap_pixels, request.pixels_per_scroll_unit)
+    logger.info(f"Viewport height: {viewport_height}, Overlap: {stepper.overlap_pixels}, "
+                f"Target scroll: {stepper.target_pixels}px, Estimate: {stepper.pixels_per_unit:.2f} px/unit")
+    
+    # Take initial screenshot
+    screenshot = await frame_cache.capture_image((window_x, window_y, viewport_width, viewport_height), max_age=0)
+    encoding = request.encoding.dict()
+    disk_writes = []
+    if request.save_screenshots:
+        disk_writes.append(session.add_image("viewport_0", screenshot))
+    previous_frame = to_gray_array(screenshot)
+    emit("viewport_captured", {"viewport": 0, "offset": 0})
+    
+    # First stage: Analyze initial screenshot and create extraction schema.
+    # In pipelined mode this runs while the remaining viewports are captured.
+    context_task = asyncio.create_task(analyze_initial_screenshot(screenshot, request.goal, request.use_cache, encoding))
+    analysis_semaphore = asyncio.Semaphore(max(1, request.max_concurrent_analyses or ANALYSIS_WORKERS))
+    analyses_by_viewport: Dict[str, Any] = {}
+    session.put_json("viewport_analyses", analyses_by_viewport)
+    failed_viewports: List[dict] = []
+    
+    def record_analysis(index: int, analysis: dict, error: Optional[str] = None):
+        analyses_by_viewport[str(index)] = analysis
+        event = {"viewport": index, "analysis": analysis}
+        if error:
+            failed_viewports.append({"viewport": index, "error": error})
+            event["error"] = error
+        emit("viewport_analysis", event)
+    
+    async def save_extraction_context() -> List[dict]:
+        extraction_context = await context_task
+        session.put_json("extraction_context", extraction_context)
+        emit("extraction_context", extraction_context)
+        record_analysis(0, extraction_context["initial_analysis"], extraction_context.get("error"))
+        return [extraction_context["initial_analysis"]]
+    
+    async def analyze_viewports(entries: List[tuple]) -> List[dict]:
+        # Second stage: Analyze screenshots using established schema, several per call when batching
+        extraction_context = await context_task
+        if "error" in extraction_context:
+            # The fallback schema would only produce guesses, so don't spend model calls on it
+            analyses = [{"content": []} for _ in entries]
+            for (index, _, _), analysis in zip(entries, analyses):
+                record_analysis(index, analysis, "Skipped: the initial analysis failed")
+            return analyses
+        async with analysis_semaphore:
+            if len(entries) == 1:
+                _, image, is_strip = entries[0]
+                analyses = [await analyze_screenshot_with_schema(image, extraction_context, request.use_cache, is_strip, encoding)]
+            else:
+                analyses = await analyze_screenshots_batch(
+                    [image for _, image, _ in entries], extraction_context, request.use_cache,
+                    [is_strip for _, _, is_strip in entries], encoding)
+        for (index, _, _), analysis in zip(entries, analyses):
+            record_analysis(index, analysis, analysis.get("error"))
+        return analyses
+    
+    async def flush_batch():
+        if not pending_batch:
+            return
+        analysis_task = asyncio.create_task(analyze_viewports(list(pending_batch)))
+        pending_batch.clear()
+        analysis_tasks.append(analysis_task)
+        if not request.pipelined:
+            await analysis_task
+    
+    analysis_tasks = [asyncio.create_task(save_extraction_context())]
+    pending_batch: List[tuple] = []
+    batch_size = max(1, request.analysis_batch_size)
+    if not request.pipelined:
+        await analysis_tasks[0]
+    
+    # Save viewport info
+    viewport_info = {
+        "viewport_height": viewport_height,
+        "overlap_pixels": stepper.overlap_pixels,
+        "target_scroll_pixels": stepper.target_pixels,
+        "pixels_per_scroll_unit": stepper.pixels_per_unit,
+        "total_scrolled": 0,
+        "estimated_total_scrolled": 0,
+        "offsets": [{"viewport": 0, "offset": 0, "estimated_offset": 0}],
+        "end_of_content": False
+    }
+    # Documents are written once, when the session closes, so later updates need no rewrite
+    session.put_json("viewport_info", viewport_info)
+    
+    # Scroll and capture until the page stops moving, up to max_viewports
+    max_viewports = max(1, request.max_viewports)
+    capture_region = (window_x, window_y, viewport_width, viewport_height)
+    # Offsets are only known while every step has been measured; estimated_offset falls back to expectations
+    total_scrolled: Optional[int] = 0
+    estimated_offset = 0
+    viewport_count = 1
+    unchanged_frames = 0
+    overshoot_retries = 0
+    units_since_previous = 0
+    capture_started = time.monotonic()
+    
     try:
-        # Infer goal if not provided
-        if not request.goal:
-            request.goal = await infer_goal_from_context(request.window_info, request.element_info)
+        while viewport_count < max_viewports:
+            # Scroll in small increments for smoothness
+            units = stepper.next_units()
+            with metrics.stage("scroll"):
+                await input_dispatcher.run(scroll_down_units, units, profile)
+            units_since_previous += units
             
-        logger.info(f"Scroll and capture request at ({request.x}, {request.y}) with goal: {request.goal}")
-        
-        if request.window_info:
-            await ensure_window_focused(request.window_info)
+            # Wait for content to load and settle; the last settle grab is the capture. Frames still
+            # showing the pre-scroll screen don't count until the app had time to start repainting
+            settle = await wait_until_stable(capture_region, timeout=request.settle_timeout, reference=screenshot)
+            screenshot = settle.image
             
-        # Move to position first
-        pyautogui.moveTo(request.x, request.y, duration=0.2)
-        
-        # Create timestamp for this capture session
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        capture_dir = os.path.join("captures", timestamp)
-        os.makedirs(capture_dir, exist_ok=True)
-        
-        # Get the window bounds
-        if not request.window_info or not request.window_info.bounds:
-            raise HTTPException(status_code=400, detail="Window bounds not provided")
+            # Measure how far the page really moved by registering this frame against the previous one
+            current_frame = to_gray_array(screenshot)
+            rows_per_pixel = current_frame.shape[0] / viewport_height
+            identical = frames_identical(previous_frame, current_frame, request.end_of_content_threshold)
+            shift_rows = None
+            if not identical:
+                # Once calibrated, displacements near the expected one are tried first; a short last
+                # scroll at the bottom of the page falls outside that window, so then search everything
+                search = stepper.search_range(units_since_previous)
+                if search:
+                    search_rows = (int(search[0] * rows_per_pixel), int(search[1] * rows_per_pixel + 0.5))
+                    shift_rows = measure_vertical_shift(previous_frame, current_frame, search_rows)
+                if shift_rows is None:
+                    shift_rows = measure_vertical_shift(previous_frame, current_frame)
             
-        bounds = request.window_info.bounds
-        viewport_width = bounds.get('width', 0)
-        viewport_height = bounds.get('height', 0)
-        window_x = bounds.get('x', 0)
-        window_y = bounds.get('y', 0)
-        
-        if viewport_width == 0 or viewport_height == 0:
-            raise HTTPException(status_code=400, detail="Invalid window dimensions")
-        
-        # Calculate scroll amount - use much smaller fixed amounts
-        base_scroll_amount = 25  # Scroll 75 pixels at a time
-        overlap_pixels = 40  # Keep 40 pixels of overlap
-        scroll_amount = base_scroll_amount - overlap_pixels  # Net 35 pixels per scroll
-        logger.info(f"Viewport height: {viewport_height}, Base scroll: {base_scroll_amount}, Overlap: {overlap_pixels}, Net scroll: {scroll_amount}")
-        
-        # Take initial screenshot
-        screenshot = pyautogui.screenshot(region=(window_x, window_y, viewport_width, viewport_height))
-        screenshot_path = os.path.join(capture_dir, f"viewport_0.png")
-        screenshot.save(screenshot_path)
-        
-        # First stage: Analyze initial screenshot and create extraction schema
-        extraction_context = await analyze_initial_screenshot(screenshot_path, request.goal)
-        with open(os.path.join(capture_dir, "extraction_context.json"), 'w') as f:
-            json.dump(extraction_context, f, indent=2)
-        
-        # Save viewport info
-        viewport_info = {
-            "viewport_height": viewport_height,
-            "base_scroll_amount": base_scroll_amount,
-            "overlap_pixels": overlap_pixels,
-            "net_scroll_amount": scroll_amount,
-            "total_scrolled": 0
-        }
-        with open(os.path.join(capture_dir, "viewport_info.json"), 'w') as f:
-            json.dump(viewport_info, f, indent=2)
-        
-        # Save initial analysis
-        with open(os.path.join(capture_dir, f"viewport_0_analysis.json"), 'w') as f:
-            json.dump(extraction_context["initial_analysis"], f, indent=2)
-        
-        # Scroll and capture multiple viewports
-        max_viewports = 5
-        scroll_delay = 1.0
-        total_scrolled = 0
-        
-        for i in range(1, max_viewports):
-            # Scroll in very small increments for smoothness
-            remaining_scroll = scroll_amount
-            while remaining_scroll > 0:
-                # Scroll in tiny chunks of 15 pixels or less
-                scroll_chunk = min(15, remaining_scroll)
-                pyautogui.scroll(-scroll_chunk)
-                remaining_scroll -= scroll_chunk
-                await asyncio.sleep(0.3)
+            # An identical or unshifted frame means the scroll didn't move the page
+            if identical or shift_rows == 0:
+                unchanged_frames += 1
+                if unchanged_frames >= max(1, request.end_of_content_frames):
+                    logger.info(f"End of content reached after {viewport_count} viewports")
+                    viewport_info["end_of_content"] = True
+                    break
+                continue
+            unchanged_frames = 0
             
-            total_scrolled += scroll_amount
-            viewport_info["total_scrolled"] = total_scrolled
+            if shift_rows is None and overshoot_retries < MAX_OVERSHOOT_RETRIES:
+                # Most likely scrolled past the overlap: go back and retry with a smaller step
+                overshoot_retries += 1
+                stepper.overshot()
+                logger.info(f"Scroll of {units_since_previous} units could not be registered; "
+                            f"scrolling back and retrying at {stepper.pixels_per_unit:.2f} px/unit")
+                with metrics.stage("scroll"):
+                    await input_dispatcher.run(scroll_down_units, units_since_previous, profile, True)
+                settle = await wait_until_stable(capture_region, timeout=request.settle_timeout, reference=screenshot)
+                screenshot = settle.image
+                if frames_identical(previous_frame, to_gray_array(screenshot), request.end_of_content_threshold):
+                    units_since_previous = 0
+                    continue
+                logger.warning("Could not return to the previous viewport; continuing with an unknown offset")
+                current_frame = to_gray_array(screenshot)
+            previous_frame = current_frame
+            overshoot_retries = 0
             
-            # Update viewport info file
-            with open(os.path.join(capture_dir, "viewport_info.json"), 'w') as f:
-                json.dump(viewport_info, f, indent=2)
+            expected_pixels = stepper.expected_pixels(units_since_previous)
+            measured_pixels = round(shift_rows / rows_per_pixel) if shift_rows is not None else None
+            # Only measurements consistent with the calibration update it (a short last scroll doesn't)
+            measurement_trusted = stepper.record(units_since_previous, measured_pixels)
+            if total_scrolled is not None:
+                total_scrolled = total_scrolled + measured_pixels if measured_pixels is not None else None
+            estimated_offset += measured_pixels if measured_pixels is not None else expected_pixels
             
-            # Wait longer for content to load and settle
-            await asyncio.sleep(scroll_delay)
+            offset_info = {
+                "viewport": viewport_count,
+                "offset": total_scrolled,  # None once any step couldn't be measured
+                "estimated_offset": estimated_offset,
+                "scroll_units": units_since_previous,
+                "expected_pixels": expected_pixels,
+                "measured_pixels": measured_pixels,
+                "measurement_trusted": measurement_trusted
+            }
+            viewport_info["offsets"].append(offset_info)
+            viewport_info["total_scrolled"] = total_scrolled
+            viewport_info["estimated_total_scrolled"] = estimated_offset
+            viewport_info["pixels_per_scroll_unit"] = stepper.pixels_per_unit
+            units_since_previous = 0
             
-            screenshot = pyautogui.screenshot(region=(window_x, window_y, viewport_width, viewport_height))
-            screenshot_path = os.path.join(capture_dir, f"viewport_{i}.png")
-            screenshot.save(screenshot_path)
+            i = viewport_count
+            viewport_count += 1
+            emit("viewport_captured", offset_info)
+            if request.save_screenshots:
+                disk_writes.append(session.add_image(f"viewport_{i}", screenshot))
             
-            # Second stage: Analyze screenshot using established schema
-            analysis = await analyze_screenshot_with_schema(screenshot_path, extraction_context)
-            with open(os.path.join(capture_dir, f"viewport_{i}_analysis.json"), 'w') as f:
-                json.dump(analysis, f, indent=2)
-        
-        # After all screenshots are captured and analyzed
-        logger.info("Merging and deduplicating analyses...")
-        merged_analysis = await merge_and_deduplicate_analyses(capture_dir, extraction_context)
+            # Only the newly revealed strip needs analyzing when the real offset is known; an
+            # untrusted measurement could be too small and cut newly revealed content off
+            strip = None
+            if request.send_new_strips_only and measurement_trusted:
+                strip = crop_new_strip(screenshot, measured_pixels, viewport_height, request.strip_context_pixels)
+            
+            pending_batch.append((i, strip if strip is not None else screenshot, strip is not None))
+            if len(pending_batch) >= batch_size:
+                await flush_batch()
         
-        return {
-            "success": True,
-            "capture_dir": capture_dir,
-            "viewport_count": max_viewports,
-            "extraction_context": extraction_context,
-            "viewport_info": viewport_info,
-            "merged_analysis": merged_analysis
-        }
+        await flush_batch()
+        capture_elapsed = time.monotonic() - capture_started
+        emit("capture_complete", {"viewport_count": viewport_count,
+                                  "end_of_content": viewport_info["end_of_content"],
+                                  "elapsed": round(capture_elapsed, 3)})
+        # gather preserves task order, so analyses come back in viewport order
+        viewport_analyses = [analysis for batch in await asyncio.gather(*analysis_tasks) for analysis in batch]
+        await asyncio.gather(*disk_writes)
+    except BaseException:
+        # Don't leave orphaned model calls running if capture fails or is cancelled
+        context_task.cancel()
+        for task in analysis_tasks:
+            task.cancel()
+        # Keep what was captured so far
+        session.close_nowait()
+        raise
+    extraction_context = context_task.result()
+    logger.info(f"Captured {viewport_count} viewports in {capture_elapsed:.2f}s, "
+                f"analyses done after {time.monotonic() - capture_started:.2f}s")
+    failed_viewports.sort(key=lambda failure: failure["viewport"])
+    if failed_viewports:
+        logger.warning(f"Analysis failed for {len(failed_viewports)} of {viewport_count} viewports")
+    session.put_json("failed_viewports", failed_viewports)
+    
+    # After all screenshots are captured and analyzed
+    logger.info("Merging and deduplicating analyses...")
+    with metrics.stage("merge"):
+        merged_analysis = await merge_and_deduplicate_analyses(
+            viewport_analyses, extraction_context, request.merge_with_model_fallback)
+    session.put_json("merged_analysis", merged_analysis)
+    await session.close()
+    emit("merged", {"merged_analysis": merged_analysis, "failed_viewports": failed_viewports})
+    
+    result = {
+        "success": "error" not in extraction_context,
+        "session_id": session.id,
+        "viewport_count": viewport_count,
+        "extraction_context": extraction_context,
+        "viewport_info": viewport_info,
+        "merged_analysis": merged_analysis,
+        "failed_viewports": failed_viewports
+    }
+    if "error" in extraction_context:
+        result["error"] = f"Initial analysis failed: {extraction_context['error']}"
+    return result
+
+@app.post("/mouse/scroll_and_capture")
+async def scroll_and_capture(request: ScrollAndCaptureRequest):
+    try:
+        return await run_scroll_and_capture(request)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in scroll and capture: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def format_sse(event: str, data: Any) -> str:
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/mouse/scroll_and_capture/stream")
+async def scroll_and_capture_stream(request: ScrollAndCaptureRequest):
+    """Same as /mouse/scroll_and_capture, but streams each stage as Server-Sent Events"""
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def run():
+        try:
+            result = await run_scroll_and_capture(request, lambda event, data: events.put_nowait((event, data)))
+            events.put_nowait(("done", {
+                "success": result["success"],
+                "session_id": result["session_id"],
+                "viewport_count": result["viewport_count"],
+                "viewport_info": result["viewport_info"],
+                "failed_viewports": result["failed_viewports"]
+            }))
+        except Exception as e:
+            logger.error(f"Error in streaming scroll and capture: {e}")
+            events.put_nowait(("error", {"detail": getattr(e, 'detail', None) or str(e)}))
+    
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await events.get()
+                yield format_sse(event, data)
+                if event in ("done", "error"):
+                    break
+        finally:
+            # Client went away: stop capturing rather than scrolling a window nobody is watching
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def job_progress_emitter(job: Job) -> Callable[[str, dict], None]:
+    """Turn scroll-and-capture events into a job's progress summary"""
+    def emit(event: str, data: dict):
+        if event == "started":
+            job.update_progress(stage="capturing", session_id=data["session_id"],
+                                viewports_captured=0, viewports_analyzed=0)
+        elif event == "viewport_captured":
+            job.update_progress(viewports_captured=job.progress.get("viewports_captured", 0) + 1)
+        elif event == "viewport_analysis":
+            job.update_progress(viewports_analyzed=job.progress.get("viewports_analyzed", 0) + 1)
+            if "error" in data:
+                failed = job.progress.get("failed_viewports", []) + [{"viewport": data["viewport"], "error": data["error"]}]
+                job.update_progress(failed_viewports=failed)
+        elif event == "capture_complete":
+            job.update_progress(stage="analyzing", capture_complete=True, viewport_count=data["viewport_count"])
+        elif event == "merged":
+            job.update_progress(stage="done", failed_viewports=data["failed_viewports"])
+    return emit
+
+@app.post("/jobs/scroll_and_capture")
+async def submit_scroll_and_capture_job(request: ScrollAndCaptureRequest):
+    async def run(job: Job) -> dict:
+        return await run_scroll_and_capture(request, job_progress_emitter(job))
+    try:
+        job = job_manager.submit("scroll_and_capture", run)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": [job.to_dict() for job in job_manager.list()]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # A run that finished without success (e.g. the initial analysis failed) still has a result
+    if job.status == SUCCEEDED or (job.status == FAILED and job.result is not None):
+        return job.result
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == CANCELLED:
+        raise HTTPException(status_code=410, detail="Job was cancelled")
+    raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job.id, "status": job.status}
+
+class RecordWorkflowRequest(BaseModel):
+    name: str  # Letters, digits, "-" and "_"
+    description: Optional[str] = None
+
+class ReplayRequest(BaseModel):
+    timing_profile: Optional[str] = None
+    window_info: Optional[WindowInfo] = None  # Target window for every step; process ids change between runs
+    check_screen: bool = True  # Compare the screen with the recording before each step
+    match_threshold: float = DEFAULT_MATCH_THRESHOLD  # Mean thumbnail difference still treated as a match
+    settle_timeout: float = 2.0  # How long a mismatching screen may take to settle before it counts as diverged
+    model_fallback: bool = True  # Ask the model to find a click target again when the screen diverged
+    keep_recorded_delays: bool = False  # Wait between steps as long as the user did while recording
+
+@app.post("/workflows/record/start")
+async def start_workflow_recording(request: RecordWorkflowRequest):
+    """Record every successful /execute and /execute/batch action until recording is stopped"""
+    try:
+        workflow_recorder.start(request.name, request.description)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "name": request.name}
+
+@app.post("/workflows/record/stop")
+async def stop_workflow_recording(discard: bool = False):
+    workflow = workflow_recorder.stop(save=not discard)
+    if workflow is None:
+        raise HTTPException(status_code=409, detail="No workflow is being recorded")
+    return {"success": True, "name": workflow["name"], "steps": len(workflow["steps"]), "saved": not discard}
+
+@app.get("/workflows")
+async def list_workflows():
+    return {"workflows": workflow_store.list(), "recording": workflow_recorder.active}
+
+def load_workflow(name: str) -> dict:
+    try:
+        return workflow_store.load(name)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"Unknown workflow: {name}")
+
+@app.get("/workflows/{name}")
+async def get_workflow(name: str):
+    return load_workflow(name)
+
+@app.delete("/workflows/{name}")
+async def delete_workflow(name: str):
+    try:
+        deleted = workflow_store.delete(name)
+    except ValueError:
+        deleted = False
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Unknown workflow: {name}")
+    return {"success": True}
+
+async def locate_target_with_model(step: dict, screenshot: Image.Image, region: Optional[tuple],
+                                   scale: float) -> Optional[BoundingBox]:
+    """Find a recorded click target on the current screen; returns its bbox in screen points, or None"""
+    screenshot_bytes, mime_type = await prepare_image(screenshot)
+    prompt = f"""
+        The first image shows a UI element, with a little of its surroundings, that was clicked
+        when this workflow was recorded. The second image is the screen now.
+        Recorded action: {json.dumps(step["action"])}
+        
+        Find the same element in the second image. Return a JSON object:
+        {{"found": true, "bbox": {{"x": 0, "y": 0, "width": 0, "height": 0}}}}
+        with the bbox in pixels of the second image, or {{"found": false}} if it isn't there.
+        """
+    contents = [prompt, ImageData(step["target_image"], "image/png"),
+                ImageData(base64.b64encode(screenshot_bytes).decode(), mime_type)]
+    result = await generate_json_async(contents, call="replay")
+    
+    if not result.get("found") or not isinstance(result.get("bbox"), dict):
+        return None
+    bbox = result["bbox"]
+    origin_x, origin_y = (region[0], region[1]) if region else (0, 0)
+    return BoundingBox(
+        x=round(origin_x + bbox["x"] / scale),
+        y=round(origin_y + bbox["y"] / scale),
+        width=max(1, round(bbox["width"] / scale)),
+        height=max(1, round(bbox["height"] / scale))
+    )
+
+@app.post("/workflows/{name}/replay")
+async def replay_workflow(name: str, request: ReplayRequest):
+    """Replay a recorded workflow without model calls while the screen matches the recording.
+
+    Before each step the target region is compared with the thumbnail taken
+    when the step was recorded. A mismatch first gets settle_timeout to
+    settle; if it still differs, a click target is located again by the model
+    (when model_fallback is on), otherwise the replay stops as diverged.
+    """
+    workflow = load_workflow(name)
+    profile = resolve_profile(request.timing_profile)
+    started = time.monotonic()
+    results = []
+    model_calls = 0
+    diverged = False
+    
+    for index, step in enumerate(workflow["steps"]):
+        step_started = time.monotonic()
+        action = Action(**step["action"])
+        window_info = request.window_info or (WindowInfo(**step["window"]) if step.get("window") else None)
+        region = window_region(window_info)
+        if request.keep_recorded_delays and step.get("delay"):
+            await asyncio.sleep(step["delay"])
+        
+        check = "skipped"
+        difference = None
+        try:
+            if request.check_screen and step.get("screen"):
+                pixels, frame = await frame_cache.capture(region, max_age=0.05)
+                difference = signature_difference(step["screen"], pixels)
+                if difference > request.match_threshold:
+                    # The page may still be loading from the previous step
+                    settle = await wait_until_stable(region, timeout=request.settle_timeout)
+                    pixels = np.asarray(settle.image)
+                    difference = signature_difference(step["screen"], pixels)
+                check = "matched" if difference <= request.match_threshold else "diverged"
+                
+                if check == "diverged":
+                    if not (request.model_fallback and action.bbox and step.get("target_image")):
+                        diverged = True
+                    else:
+                        model_calls += 1
+                        bbox = await locate_target_with_model(step, Image.fromarray(pixels), region, frame.scale)
+                        if bbox is None:
+                            diverged = True
+                        else:
+                            action.bbox = bbox
+                            check = "relocated"
+            
+            if diverged:
+                results.append({"index": index, "action": action.action, "status": "diverged",
+                                "difference": round(difference, 4)})
+                break
+            await run_input(window_info, perform_action, action, profile)
+            results.append({"index": index, "action": action.action, "status": "ok", "check": check,
+                            "difference": round(difference, 4) if difference is not None else None,
+                            "elapsed": round(time.monotonic() - step_started, 4)})
+        except Exception as e:
+            logger.error(f"Error replaying step {index} of workflow {name}: {e}")
+            results.append({"index": index, "action": action.action, "status": "error", "error": str(e)})
+            break
+    
+    completed = len(results) == len(workflow["steps"]) and all(result["status"] == "ok" for result in results)
+    metrics.inc("chicory_workflow_replays_total", outcome="completed" if completed else "diverged" if diverged else "error")
+    return {
+        "success": completed,
+        "diverged": diverged,
+        "steps": results,
+        "model_calls": model_calls,
+        "total_time": round(time.monotonic() - started, 4)
+    }
+
 if __name__ == "__main__":
-    logger.info("Starting automation service on http://127.0.0.1:8123")
-    logger.info("PyAutoGUI configured with FAILSAFE=True and PAUSE=0.1s")
-    uvicorn.run(app, host="127.0.0.1", port=8123, log_level="info") 
\ No newline at end of file
+    port = int(os.getenv('CHICORY_SERVICE_PORT', '8123'))
+    logger.info(f"Starting automation service on http://127.0.0.1:{port}")
+    logger.info(f"Input timing profile: {input_actions.get_profile().name}")
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="info") 
\ No newline at end of file
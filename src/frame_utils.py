@@ -0,0 +1,81 @@
+from typing import Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+
+# Frames are compared at reduced width; small enough to be cheap, large enough to see a one-line scroll
+COMPARE_WIDTH = 320
+
+def to_gray_array(image: Union[Image.Image, np.ndarray], width: int = COMPARE_WIDTH) -> np.ndarray:
+    """Downscaled grayscale float32 array of a screenshot for cheap frame comparisons"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if width and image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.BILINEAR)
+    return np.asarray(image.convert('L'), dtype=np.float32) / 255.0
+
+def frame_difference(previous: np.ndarray, current: np.ndarray) -> float:
+    """Mean absolute pixel difference between two gray frames, 0.0 (identical) to 1.0"""
+    if previous.shape != current.shape:
+        return 1.0
+    return float(np.mean(np.abs(current - previous)))
+
+def frames_identical(previous: np.ndarray, current: np.ndarray, threshold: float = 0.002) -> bool:
+    """True if two frames are the same up to noise such as a blinking caret or anti-aliasing"""
+    return frame_difference(previous, current) <= threshold
+
+def _row_signatures(frame: np.ndarray, blocks: int = 32) -> np.ndarray:
+    """Collapse each row into a few column-block means so registration stays cheap"""
+    width = frame.shape[1] - frame.shape[1] % blocks
+    if width <= 0:
+        return frame
+    return frame[:, :width].reshape(frame.shape[0], blocks, -1).mean(axis=2)
+
+def measure_vertical_shift(previous: np.ndarray, current: np.ndarray, search: Optional[Tuple[int, int]] = None,
+                           min_overlap: float = 0.08, max_error: float = 0.03,
+                           min_margin: float = 0.004, neighbourhood: int = 3) -> Optional[int]:
+    """Rows the content moved up between two gray frames, found by vertical registration.
+
+    Tries shift 0 plus every shift in search (low, high rows; default all)
+    that leaves at least min_overlap of the frame overlapping. Returns None
+    when even the best match is worse than max_error (content changed, or
+    scrolled past the overlap) or when another shift outside the best one's
+    neighbourhood matches nearly as well: repeating rows (lists built from
+    one template) match at many shifts, and picking one of them would be a
+    confident wrong answer.
+    """
+    if previous.shape != current.shape:
+        return None
+    height = previous.shape[0]
+    previous_rows = _row_signatures(previous)
+    current_rows = _row_signatures(current)
+    min_rows = max(4, int(height * min_overlap))
+    max_shift = height - min_rows
+    low, high = search if search is not None else (0, max_shift)
+    shifts = {0} | set(range(max(0, low), min(max_shift, high) + 1))
+    errors = {shift: float(np.mean(np.abs(previous_rows[shift:] - current_rows[:height - shift])))
+              for shift in shifts}
+    best_shift = min(errors, key=errors.get)
+    best_error = errors[best_shift]
+    if best_error > max_error:
+        return None
+    rivals = [error for shift, error in errors.items() if abs(shift - best_shift) > neighbourhood]
+    if rivals and min(rivals) < max(2 * best_error, best_error + min_margin):
+        return None
+    return best_shift
+
+def crop_new_strip(image: Image.Image, shift_pixels: Optional[int], viewport_height: int,
+                   context_pixels: int = 40) -> Optional[Image.Image]:
+    """Bottom strip of a frame revealed by scrolling shift_pixels, plus context_pixels of already-seen content.
+
+    shift_pixels and context_pixels are in window coordinates; the image may be
+    larger (e.g. Retina captures). Returns None when the strip would be (almost)
+    the whole frame or the shift is unknown, in which case the full frame should be used.
+    """
+    if not shift_pixels or shift_pixels <= 0:
+        return None
+    scale = image.height / viewport_height
+    strip_height = round((shift_pixels + context_pixels) * scale)
+    if strip_height >= image.height * 0.9:
+        return None
+    return image.crop((0, image.height - strip_height, image.width, image.height))
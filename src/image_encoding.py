@@ -0,0 +1,51 @@
+import io
+from typing import Optional, Tuple, Union
+from PIL import Image
+
+ImageInput = Union[str, bytes, Image.Image]
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp"
+}
+
+def encode_image(image: Image.Image, format: str = "PNG", quality: int = 85, compress_level: int = 1,
+                 max_dimension: Optional[int] = None) -> Tuple[bytes, str]:
+    """Encode a PIL image in memory, returning (bytes, mime type).
+
+    compress_level applies to PNG (0-9, lower is faster); quality applies to
+    JPEG and WebP. max_dimension downscales so neither side exceeds it.
+    """
+    format = format.upper()
+    if format == "JPG":
+        format = "JPEG"
+    if format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {format}")
+    if max_dimension and max(image.size) > max_dimension:
+        scale = max_dimension / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if format == "PNG":
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    else:
+        image.save(buffer, format=format, quality=quality)
+    return buffer.getvalue(), MIME_TYPES[format]
+
+def _sniff_mime_type(data: bytes) -> str:
+    if data.startswith(b"\xff\xd8"):
+        return MIME_TYPES["JPEG"]
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return MIME_TYPES["WEBP"]
+    return MIME_TYPES["PNG"]
+
+def load_image_bytes(image: ImageInput, **encoding) -> Tuple[bytes, str]:
+    """Bytes and mime type for a file path, already-encoded bytes or an in-memory PIL image"""
+    if isinstance(image, Image.Image):
+        return encode_image(image, **encoding)
+    if isinstance(image, str):
+        with open(image, 'rb') as img_file:
+            image = img_file.read()
+    return image, _sniff_mime_type(image)
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# pyautogui is imported on first use (on the input thread) so it doesn't delay service startup
+pyautogui = None
+
+def load_pyautogui():
+    """Import and configure pyautogui once"""
+    global pyautogui
+    if pyautogui is None:
+        import pyautogui as module
+        module.FAILSAFE = True  # Move mouse to corner to abort
+        module.PAUSE = 0.1  # Only applies to calls made without _pause=False
+        pyautogui = module
+    return pyautogui
+
+@dataclass(frozen=True)
+class TimingProfile:
+    name: str
+    move_duration: float  # Seconds for each pointer movement
+    pause: float  # Pause after each input action
+    typing_interval: float  # Delay between typed characters
+    paste_threshold: Optional[int]  # Texts at least this long are pasted; None never pastes
+
+TIMING_PROFILES = {
+    # Matches the original pacing: smooth pointer moves and a 0.1 s pause after every action
+    "human": TimingProfile("human", move_duration=0.2, pause=0.1, typing_interval=0.0, paste_threshold=None),
+    "fast": TimingProfile("fast", move_duration=0.05, pause=0.02, typing_interval=0.0, paste_threshold=32),
+    "instant": TimingProfile("instant", move_duration=0.0, pause=0.0, typing_interval=0.0, paste_threshold=1)
+}
+
+def get_profile(name: Optional[str] = None) -> TimingProfile:
+    """Named profile, or the global default when name is None"""
+    if name is None:
+        return _default_profile
+    if name not in TIMING_PROFILES:
+        raise ValueError(f"Unknown timing profile: {name} (expected one of {', '.join(TIMING_PROFILES)})")
+    return TIMING_PROFILES[name]
+
+_default_profile = get_profile(os.getenv('CHICORY_TIMING_PROFILE', 'human'))
+
+def set_default_profile(name: str) -> TimingProfile:
+    global _default_profile
+    _default_profile = get_profile(name)
+    return _default_profile
+
+def _pause(profile: TimingProfile):
+    if profile.pause:
+        time.sleep(profile.pause)
+
+# pyautogui's own PAUSE is bypassed with _pause=False so the profile alone decides pacing
+
+def move_to(x: int, y: int, profile: TimingProfile):
+    load_pyautogui().moveTo(x, y, duration=profile.move_duration, _pause=False)
+    _pause(profile)
+
+def click(x: int, y: int, profile: TimingProfile, button: str = 'left'):
+    move_to(x, y, profile)
+    load_pyautogui().click(button=button, _pause=False)
+    _pause(profile)
+
+def scroll(clicks: int, profile: TimingProfile, horizontal: bool = False):
+    if horizontal:
+        load_pyautogui().hscroll(clicks, _pause=False)
+    else:
+        load_pyautogui().scroll(clicks, _pause=False)
+    _pause(profile)
+
+def press_key(key: str, profile: TimingProfile):
+    load_pyautogui().press(key, _pause=False)
+    _pause(profile)
+
+def paste_text(text: str, profile: TimingProfile):
+    """Enter text through the clipboard in one keystroke, restoring the previous clipboard afterwards"""
+    import pyperclip
+    try:
+        previous = pyperclip.paste()
+    except pyperclip.PyperclipException:
+        previous = None
+    pyperclip.copy(text)
+    load_pyautogui().hotkey('command' if sys.platform == 'darwin' else 'ctrl', 'v', _pause=False)
+    # Give the target app a moment to read the clipboard before it is restored
+    time.sleep(0.05)
+    if previous is not None:
+        pyperclip.copy(previous)
+    _pause(profile)
+
+def type_text(text: str, profile: TimingProfile, text_entry: Optional[str] = None):
+    """Type text per character or paste it; text_entry ("type" or "paste") overrides the profile's threshold"""
+    if text_entry is None:
+        use_paste = profile.paste_threshold is not None and len(text) >= profile.paste_threshold
+    elif text_entry in ("type", "paste"):
+        use_paste = text_entry == "paste"
+    else:
+        raise ValueError(f"Unknown text entry mode: {text_entry}")
+    if use_paste:
+        paste_text(text, profile)
+    else:
+        load_pyautogui().typewrite(text, interval=profile.typing_interval, _pause=False)
+        _pause(profile)
@@ -0,0 +1,84 @@
+import os
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.getenv('CHICORY_INPUT_TIMEOUT', '30'))
+
+class InputCommandTimeout(TimeoutError):
+    """Raised when an input command doesn't finish within its timeout"""
+
+class InputDispatcher:
+    """Single worker thread that owns the mouse, keyboard and screen.
+
+    Handlers submit callables and await them; commands run one at a time in
+    submission order, so the event loop never blocks on pyautogui and events
+    from concurrent requests can't interleave. A command that needs several
+    input events to stay together (focus, move, click) should be submitted
+    as one callable.
+    """
+
+    def __init__(self, default_timeout: float = DEFAULT_TIMEOUT):
+        self.default_timeout = default_timeout
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name='input-dispatch', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Finish queued commands, then stop the worker"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            fn, args, kwargs, future = item
+            # Skip commands whose caller already gave up (timed out or cancelled)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) on the input thread"""
+        self.start()
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run fn on the input thread and await its result.
+
+        If it hasn't finished within timeout seconds an InputCommandTimeout is
+        raised; a command still waiting in the queue is dropped, one already
+        running is allowed to finish.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        future = asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            name = getattr(fn, '__name__', repr(fn))
+            raise InputCommandTimeout(f"Input command {name} timed out after {timeout:.1f}s")
+
+input_dispatcher = InputDispatcher()
@@ -0,0 +1,113 @@
+import time
+import uuid
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable, Awaitable, List
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def update_progress(self, **progress):
+        self.progress.update(progress)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "error": self.error
+        }
+
+class JobManager:
+    """Runs long operations as background jobs with a concurrency limit and a bounded queue.
+
+    Finished jobs are kept for retention_seconds so their results can be fetched.
+    """
+
+    def __init__(self, max_concurrent: int = 1, max_queued: int = 16, retention_seconds: float = 3600):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.status in FINISHED_STATES and job.finished_at and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def submit(self, kind: str, run: Callable[[Job], Awaitable[Any]]) -> Job:
+        """Queue run(job) and return the job immediately"""
+        self._prune()
+        if self._semaphore is None:
+            # Created lazily so it binds to the server's event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+        if queued >= self.max_queued:
+            raise JobQueueFull(f"Job queue is full ({queued} queued)")
+        job = Job(kind)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, run))
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]):
+        try:
+            async with self._semaphore:
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.result = await run(job)
+                if isinstance(job.result, dict) and job.result.get("success") is False:
+                    # The run finished but didn't achieve its goal; its result is still kept
+                    job.status = FAILED
+                    job.error = job.result.get("error")
+                else:
+                    job.status = SUCCEEDED
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.status = FAILED
+            job.error = getattr(e, 'detail', None) or str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        self._prune()
+        return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job; finished jobs are left as they are"""
+        job = self._jobs.get(job_id)
+        if job and job.status not in FINISHED_STATES and job.task:
+            job.task.cancel()
+        return job
@@ -0,0 +1,209 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Time spent in each stage of a request, labelled by stage (focus, scroll, settle, screenshot, ...)
+STAGE_SECONDS = "chicory_stage_seconds"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[int]:
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation (None past the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return None
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms, rendered as Prometheus text or JSON.
+
+    Safe to update from any thread. Collectors registered with add_collector
+    are called at scrape time and return gauge values, so stats that other
+    components already keep (cache hits, queue depth) don't need mirroring.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + delta
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall time of the with-block, awaits included"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    @contextmanager
+    def in_flight(self, name: str, **labels):
+        """Count the with-block in a gauge while it runs"""
+        self.add_gauge(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1, **labels)
+
+    def stage(self, stage: str):
+        """Timer for one stage of a request, e.g. `with metrics.stage("settle"):`"""
+        return self.timer(STAGE_SECONDS, stage=stage)
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        """collector() returns {metric name: value}, read as gauges at scrape time"""
+        self._collectors.append(collector)
+
+    def _collected_gauges(self) -> Dict[str, Dict[LabelKey, float]]:
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                values = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, value in values.items():
+                if value is not None:
+                    gauges.setdefault(name, {})[()] = float(value)
+        return gauges
+
+    def _snapshot(self):
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            histograms = {name: {key: (h.buckets, h.cumulative(), h.count, h.sum, h.quantile(0.5), h.quantile(0.95))
+                                 for key, h in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, series in self._collected_gauges().items():
+            gauges.setdefault(name, {}).update(series)
+        return counters, gauges, histograms
+
+    def render_prometheus(self) -> str:
+        counters, gauges, histograms = self._snapshot()
+        lines = []
+
+        def header(name: str, kind: str):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name, series in sorted(counters.items()):
+            header(name, "counter")
+            lines.extend(f"{name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(series.items()))
+        for name, series in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.extend(f"{name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(series.items()))
+        for name, series in sorted(histograms.items()):
+            header(name, "histogram")
+            for key, (buckets, cumulative, count, total, _, _) in sorted(series.items()):
+                for bound, value in zip(buckets, cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(float(bound))))} {value}")
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        counters, gauges, histograms = self._snapshot()
+
+        def flat(series: dict) -> List[dict]:
+            return [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+
+        return {
+            "counters": {name: flat(series) for name, series in sorted(counters.items())},
+            "gauges": {name: flat(series) for name, series in sorted(gauges.items())},
+            "histograms": {
+                name: [{
+                    "labels": dict(key),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "mean": round(total / count, 6) if count else None,
+                    "p50_le": p50,
+                    "p95_le": p95,
+                    "buckets": {repr(float(bound)): value for bound, value in zip(buckets, cumulative)}
+                } for key, (buckets, cumulative, count, total, p50, p95) in sorted(series.items())]
+                for name, series in sorted(histograms.items())
+            }
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+metrics = MetricsRegistry()
+metrics.describe(STAGE_SECONDS, "Seconds spent in each stage of a request")
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Optional
+from collections import deque
+from metrics import metrics, SIZE_BUCKETS
+from model_client import ImageData, get_model, build_contents
+
+logger = logging.getLogger(__name__)
+
+# Vertex AI errors worth another attempt: quota, overload and transient server failures
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                         "BadGateway", "GatewayTimeout", "DeadlineExceeded", "Aborted"}
+# The subset that means "too much load", which shrinks the concurrency limit
+OVERLOAD_STATUS_CODES = {429, 503}
+OVERLOAD_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+FENCE_PATTERN = re.compile(r'^```[A-Za-z]*\s*(.*?)\s*```$', re.DOTALL)
+
+class ModelResponseError(ValueError):
+    """Raised when a model response has no text or isn't the JSON that was asked for"""
+
+class _DeadlinePassed(Exception):
+    """Raised inside ModelCaller when the call's deadline passes"""
+
+class ModelCallError(Exception):
+    """Raised when a model call runs out of attempts or hits its deadline"""
+
+    def __init__(self, message: str, call: str, attempts: int):
+        super().__init__(message)
+        self.call = call
+        self.attempts = attempts
+
+def _status_code(error: BaseException) -> Optional[int]:
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (ModelResponseError, ConnectionError, TimeoutError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+def is_overload(error: Optional[BaseException]) -> bool:
+    if error is None:
+        return False
+    return _status_code(error) in OVERLOAD_STATUS_CODES or type(error).__name__ in OVERLOAD_ERROR_NAMES
+
+def parse_json_response(text: str) -> Any:
+    """Parse a model answer as JSON, tolerating a markdown fence or prose around one object"""
+    text = text.strip()
+    fenced = FENCE_PATTERN.match(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    start = text.find('{')
+    end = text.rfind('}') + 1
+    if start >= 0 and end > start:
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError:
+            pass
+    raise ModelResponseError(f"Could not parse model response as JSON: {text[:200]!r}")
+
+def response_text(response) -> str:
+    try:
+        text = response.text
+    except ValueError as e:
+        # The SDK raises for blocked or empty candidates instead of returning ""
+        raise ModelResponseError(f"Model response has no text: {e}")
+    if not text or not text.strip():
+        raise ModelResponseError("Model response is empty")
+    return text
+
+class AdaptiveLimiter:
+    """Caps concurrent model calls with a limit that adapts to how the backend copes (AIMD).
+
+    Each call that finishes quickly and without an overload error raises the
+    limit by 1/limit, so about one slot per limit's worth of calls. An overload
+    error (429/503) or a call slower than latency_target halves it, at most
+    once per cooldown seconds so a burst of failures from calls already in
+    flight counts as one signal. Used from the event loop only; release may
+    be scheduled from worker threads with call_soon_threadsafe.
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 8,
+                 latency_target: Optional[float] = 30.0, decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self):
+        """Wait for a slot; every acquire must be paired with one release"""
+        if self._has_capacity() and not self.waiting:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller gave up
+                self._return_slot()
+            raise
+
+    def release(self, latency: float, overloaded: bool = False):
+        """Free a slot and adjust the limit from the call's latency and outcome"""
+        slow = self.latency_target is not None and latency > self.latency_target
+        if overloaded or slow:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                self._last_decrease = now
+                self.decreases += 1
+                logger.info(f"Model concurrency limit lowered to {int(self.limit)} "
+                            f"({'overload' if overloaded else f'{latency:.1f}s call'})")
+        elif self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self.increases += 1
+        self._return_slot()
+
+    def _return_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "increases": self.increases,
+            "decreases": self.decreases
+        }
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    """Positive float from the environment; 0 turns the setting off"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    value = float(value)
+    return value if value > 0 else None
+
+def payload_size(contents) -> int:
+    """Approximate request size in bytes: prompt text plus inline image data"""
+    parts = contents if isinstance(contents, list) else [contents]
+    size = 0
+    for part in parts:
+        if isinstance(part, str):
+            size += len(part.encode())
+        elif isinstance(part, ImageData):
+            size += part.size
+        else:
+            size += len(getattr(getattr(part, 'inline_data', None), 'data', b'') or b'')
+    return size
+
+class ModelCaller:
+    """The one path for model calls: limiter, retries with jittered backoff, deadline and JSON parsing.
+
+    A call gets max_attempts tries within deadline seconds, waiting for a
+    limiter slot included. Retryable failures (quota, overload, transient
+    server errors and unparseable JSON) back off for a random time up to
+    backoff_base * 2**attempt, capped at backoff_max. A worker thread that
+    outlives the deadline keeps its limiter slot until it actually returns.
+
+    Everything that touches the SDK runs on the worker thread as well:
+    model_factory() resolves the model when a call passes none, and
+    prepare_contents turns the contents into SDK parts (e.g. ImageData).
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter, max_attempts: int = 3, deadline: Optional[float] = 120.0,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, json_mode: bool = True,
+                 model_factory: Optional[Callable[[], Any]] = None,
+                 prepare_contents: Optional[Callable[[Any], Any]] = None):
+        self.limiter = limiter
+        self.model_factory = model_factory
+        self.prepare_contents = prepare_contents
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.json_mode = json_mode
+        self._rng = random.Random()
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the exponential cap for this attempt (1-based)"""
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _attempt(self, executor: Executor, model, contents, kwargs: dict, timeout: Optional[float]):
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.limiter.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise _DeadlinePassed()
+        started = time.monotonic()
+
+        def done(future: Future):
+            # Worker thread: hand the outcome to the limiter on the event loop
+            error = None if future.cancelled() else future.exception()
+            try:
+                loop.call_soon_threadsafe(self.limiter.release, time.monotonic() - started, is_overload(error))
+            except RuntimeError:
+                pass  # Loop already closed at shutdown
+
+        def generate():
+            # Worker thread: resolving the model and building parts may import or initialize the SDK
+            resolved = model if model is not None else self.model_factory()
+            prepared = self.prepare_contents(contents) if self.prepare_contents else contents
+            return resolved.generate_content(prepared, **kwargs)
+
+        try:
+            future = executor.submit(generate)
+        except BaseException:
+            self.limiter.release(0.0)
+            raise
+        future.add_done_callback(done)
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                raise  # The SDK's own timeout, retried like other transient errors
+            raise _DeadlinePassed()
+
+    async def call(self, executor: Executor, model, contents, call: str = "other",
+                   parse: Optional[Callable[[Any], Any]] = None, json_output: bool = False,
+                   deadline: Optional[float] = None) -> Any:
+        """Run model.generate_content(contents) in executor; returns parse(response) or the response.
+
+        model may be None to use model_factory(). call names the kind of request in metrics. json_output asks the model
+        for application/json (when json_mode is on); parse failures raise
+        ModelResponseError and are retried like transient errors.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        deadline_at = time.monotonic() + deadline if deadline else None
+        kwargs = {"generation_config": dict(JSON_GENERATION_CONFIG)} if json_output and self.json_mode else {}
+        metrics.observe("chicory_model_request_bytes", payload_size(contents), buckets=SIZE_BUCKETS, call=call)
+        attempt = 0
+        with metrics.in_flight("chicory_model_calls_in_flight"), metrics.stage(f"model_{call}"):
+            while True:
+                attempt += 1
+                remaining = None if deadline_at is None else deadline_at - time.monotonic()
+                try:
+                    if remaining is not None and remaining <= 0:
+                        raise _DeadlinePassed()
+                    response = await self._attempt(executor, model, contents, kwargs, remaining)
+                    result = parse(response) if parse else response
+                    break
+                except _DeadlinePassed:
+                    metrics.inc("chicory_model_calls_total", call=call, outcome="deadline")
+                    raise ModelCallError(f"Model call '{call}' exceeded its {deadline:g}s deadline",
+                                         call, attempt)
+                except Exception as e:
+                    outcome = "invalid_response" if isinstance(e, ModelResponseError) else "error"
+                    delay = self.backoff(attempt)
+                    remaining = None if deadline_at is None else deadline_at - time.monotonic()
+                    if (not is_retryable(e) or attempt >= self.max_attempts
+                            or (remaining is not None and delay >= remaining)):
+                        metrics.inc("chicory_model_calls_total", call=call, outcome=outcome)
+                        if attempt > 1 or is_retryable(e):
+                            raise ModelCallError(f"Model call '{call}' failed after {attempt} attempt(s): {e}",
+                                                 call, attempt) from e
+                        raise
+                    metrics.inc("chicory_model_retries_total", call=call, reason=outcome)
+                    logger.warning(f"Model call '{call}' attempt {attempt} failed ({e}); retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        metrics.inc("chicory_model_calls_total", call=call, outcome="ok")
+        try:
+            metrics.observe("chicory_model_response_bytes", len(response.text.encode()), buckets=SIZE_BUCKETS, call=call)
+        except Exception:
+            # Blocked or empty responses have no text; callers deal with those
+            pass
+        return result
+
+    async def call_json(self, executor: Executor, model, contents, call: str = "other",
+                        deadline: Optional[float] = None) -> Any:
+        """JSON-constrained call returning the parsed answer"""
+        return await self.call(executor, model, contents, call=call, json_output=True, deadline=deadline,
+                               parse=lambda response: parse_json_response(response_text(response)))
+
+model_limiter = AdaptiveLimiter(
+    initial=int(os.getenv('CHICORY_MODEL_CONCURRENCY', '4')),
+    min_limit=int(os.getenv('CHICORY_MODEL_MIN_CONCURRENCY', '1')),
+    max_limit=int(os.getenv('CHICORY_MODEL_MAX_CONCURRENCY', '8')),
+    latency_target=_env_float('CHICORY_MODEL_LATENCY_TARGET', 30.0)
+)
+model_caller = ModelCaller(
+    model_limiter,
+    max_attempts=int(os.getenv('CHICORY_MODEL_MAX_ATTEMPTS', '3')),
+    deadline=_env_float('CHICORY_MODEL_DEADLINE', 120.0),
+    json_mode=os.getenv('CHICORY_MODEL_JSON_MODE', '1').lower() not in ('0', 'false', 'no'),
+    model_factory=get_model,
+    prepare_contents=build_contents
+)
@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Optional, Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from vertexai.preview.generative_models import GenerativeModel, Part
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'gemini-1.5-flash-001'
+
+class ModelRegistry:
+    """Process-wide Vertex AI client and GenerativeModel cache.
+
+    aiplatform.init runs once and each model name is built once, then shared
+    by every request. Settings come from the environment unless overridden
+    with configure().
+    """
+
+    def __init__(self, project: Optional[str] = None, location: Optional[str] = None,
+                 default_model: Optional[str] = None):
+        self.project = project or os.getenv('GOOGLE_CLOUD_PROJECT')
+        self.location = location or os.getenv('GOOGLE_CLOUD_LOCATION')
+        self.default_model = default_model or os.getenv('CHICORY_MODEL_NAME', DEFAULT_MODEL_NAME)
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._models: Dict[str, "GenerativeModel"] = {}
+        self.load_time: Optional[float] = None
+        self._stub_model: Any = None
+        self.part_factory: Optional[Callable[[str, str], Any]] = None
+
+    def configure(self, project: Optional[str] = None, location: Optional[str] = None,
+                  default_model: Optional[str] = None):
+        """Change project/location/model and drop any cached clients"""
+        with self._lock:
+            if project is not None:
+                self.project = project
+            if location is not None:
+                self.location = location
+            if default_model is not None:
+                self.default_model = default_model
+            self._initialized = False
+            self._models.clear()
+
+    def use_stub(self, model: Any, part_factory: Callable[[str, str], Any]):
+        """Serve model for every name and build image parts with part_factory(data, mime_type).
+
+        The SDK is never imported; used by the benchmarks and for offline runs.
+        """
+        with self._lock:
+            self._stub_model = model
+            self.part_factory = part_factory
+            self.load_time = 0.0
+            self._initialized = True
+            self._models.clear()
+
+    @property
+    def loaded(self) -> bool:
+        return self.load_time is not None
+
+    def load(self) -> float:
+        """Import the Vertex AI SDK, which takes seconds, so the service can answer /health first"""
+        if self.load_time is None:
+            started = time.monotonic()
+            from google.cloud import aiplatform  # noqa: F401
+            from vertexai.preview import generative_models  # noqa: F401
+            self.load_time = time.monotonic() - started
+            logger.info(f"Vertex AI SDK loaded in {self.load_time:.2f}s")
+        return self.load_time
+
+    def _ensure_initialized(self):
+        # Caller holds self._lock
+        if self._initialized:
+            return
+        self.load()
+        from google.cloud import aiplatform
+        init_kwargs = {'project': self.project}
+        if self.location:
+            init_kwargs['location'] = self.location
+        aiplatform.init(**init_kwargs)
+        self._initialized = True
+        logger.info(f"Vertex AI initialized for project={self.project} location={self.location or 'default'}")
+
+    def get_model(self, name: Optional[str] = None) -> "GenerativeModel":
+        """Return the shared model for name, creating it on first use"""
+        if self._stub_model is not None:
+            return self._stub_model
+        name = name or self.default_model
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                self._ensure_initialized()
+                from vertexai.preview.generative_models import GenerativeModel
+                self._models[name] = GenerativeModel(name)
+            return self._models[name]
+
+    def warm_up(self, name: Optional[str] = None) -> float:
+        """Build the model and make one tiny call so the first real request skips connection setup"""
+        started = time.monotonic()
+        model = self.get_model(name)
+        model.generate_content("Reply with OK")
+        elapsed = time.monotonic() - started
+        logger.info(f"Model {name or self.default_model} warmed up in {elapsed:.2f}s")
+        return elapsed
+
+model_registry = ModelRegistry()
+
+def get_model(name: Optional[str] = None) -> "GenerativeModel":
+    """Shortcut for model_registry.get_model"""
+    return model_registry.get_model(name)
+
+class ImageData:
+    """Base64 image content for a model call, left for build_contents to turn into a Part.
+
+    Building a Part may import the SDK, so it happens on the worker thread
+    that makes the call rather than on the event loop.
+    """
+
+    def __init__(self, data: str, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+
+    @property
+    def size(self) -> int:
+        """Approximate decoded size in bytes"""
+        return len(self.data) * 3 // 4
+
+def make_image_part(data: str, mime_type: str) -> "Part":
+    """Image content part for generate_content, importing the SDK on first use"""
+    if model_registry.part_factory is not None:
+        return model_registry.part_factory(data, mime_type)
+    model_registry.load()
+    from vertexai.preview.generative_models import Part
+    return Part.from_data(data=data, mime_type=mime_type)
+
+def build_contents(contents):
+    """contents with every ImageData turned into an SDK Part; runs on the thread making the call"""
+    if isinstance(contents, list):
+        return [make_image_part(part.data, part.mime_type) if isinstance(part, ImageData) else part
+                for part in contents]
+    return contents
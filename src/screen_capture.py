@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+from frame_utils import to_gray_array, frames_identical
+from input_dispatch import input_dispatcher
+from input_actions import load_pyautogui
+from metrics import metrics, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+Region = Tuple[int, int, int, int]  # x, y, width, height
+
+# Settle checks compare very small frames; only layout and scroll movement matter
+SETTLE_COMPARE_WIDTH = 160
+# How long a region may look unchanged after an input before that counts as "nothing happened"
+DEFAULT_REPAINT_WAIT = 0.3
+
+@dataclass
+class SettleResult:
+    stable: bool
+    elapsed: float
+    frames: int
+    image: Optional[Image.Image]  # Last full-resolution grab, reusable as the capture
+    moved: bool = True  # False if the region never differed from the reference frame
+
+@dataclass
+class Frame:
+    timestamp: float  # time.monotonic() when the grab finished
+    pixels: np.ndarray  # Full screen, H x W x 3 uint8
+    scale: float  # Frame pixels per screen point (2.0 on Retina displays)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.timestamp
+
+    def crop(self, region: Optional[Region] = None) -> np.ndarray:
+        """Zero-copy view of a region given in screen points, clipped to the frame"""
+        if region is None:
+            return self.pixels
+        x, y, width, height = (round(value * self.scale) for value in region)
+        frame_height, frame_width = self.pixels.shape[:2]
+        left, top = max(0, x), max(0, y)
+        # Clamped at left/top too, so a region entirely off-screen gives an empty view instead of wrapping
+        right, bottom = max(left, min(frame_width, x + width)), max(top, min(frame_height, y + height))
+        return self.pixels[top:bottom, left:right]
+
+def _grab_screen() -> Frame:
+    # Runs on the input thread
+    pyautogui = load_pyautogui()
+    image = pyautogui.screenshot()
+    pixels = np.asarray(image.convert('RGB'))
+    screen_width = pyautogui.size()[0]
+    return Frame(time.monotonic(), pixels, pixels.shape[1] / screen_width if screen_width else 1.0)
+
+class FrameCache:
+    """Full-screen grabs shared by every consumer within a freshness window.
+
+    Keeps the last few frames in a ring buffer; callers get region crops as
+    NumPy views of a single capture instead of triggering their own grabs.
+    Concurrent requests for a fresh frame wait on the same in-flight grab.
+    """
+
+    def __init__(self, capacity: int = 4, freshness: float = 0.1):
+        self.freshness = freshness
+        self.frames: deque = deque(maxlen=capacity)
+        self.grabs = 0
+        self.hits = 0
+        self.total_grab_time = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    @property
+    def latest(self) -> Optional[Frame]:
+        return self.frames[-1] if self.frames else None
+
+    async def frame(self, max_age: Optional[float] = None) -> Frame:
+        """A full-screen frame no older than max_age seconds (default: the freshness window)"""
+        max_age = self.freshness if max_age is None else max_age
+        latest = self.latest
+        if latest is not None and latest.age <= max_age:
+            self.hits += 1
+            return latest
+        if self._inflight is not None and not self._inflight.done():
+            self.hits += 1
+            return await asyncio.shield(self._inflight)
+        self._inflight = asyncio.ensure_future(self._grab())
+        return await asyncio.shield(self._inflight)
+
+    async def _grab(self) -> Frame:
+        started = time.monotonic()
+        # Grabs go through the input thread so they are ordered after any scroll that preceded them
+        with metrics.stage("screenshot"):
+            frame = await input_dispatcher.run(_grab_screen)
+        self.grabs += 1
+        self.total_grab_time += time.monotonic() - started
+        self.frames.append(frame)
+        return frame
+
+    async def capture(self, region: Optional[Region] = None, max_age: Optional[float] = None) -> Tuple[np.ndarray, Frame]:
+        """Region of a fresh frame as a zero-copy view, plus the frame it came from"""
+        frame = await self.frame(max_age)
+        return frame.crop(region), frame
+
+    async def capture_image(self, region: Optional[Region] = None, max_age: Optional[float] = None) -> Image.Image:
+        """Region of a fresh frame as a PIL image (copies the pixels)"""
+        pixels, _ = await self.capture(region, max_age)
+        return Image.fromarray(pixels)
+
+    def stats(self) -> dict:
+        lookups = self.grabs + self.hits
+        return {
+            "frames_buffered": len(self.frames),
+            "capacity": self.frames.maxlen,
+            "freshness": self.freshness,
+            "grabs": self.grabs,
+            "shared_hits": self.hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "average_grab_time": round(self.total_grab_time / self.grabs, 4) if self.grabs else 0.0,
+            "latest_age": round(self.latest.age, 4) if self.latest else None
+        }
+
+frame_cache = FrameCache(
+    capacity=int(os.getenv('CHICORY_FRAME_BUFFER', '4')),
+    freshness=float(os.getenv('CHICORY_FRAME_FRESHNESS', '0.1'))
+)
+
+async def wait_until_stable(region: Optional[Region] = None, stable_frames: int = 3, threshold: float = 0.002,
+                            interval: float = 0.05, timeout: float = 2.0,
+                            reference: Optional[Union[Image.Image, np.ndarray]] = None,
+                            repaint_wait: float = DEFAULT_REPAINT_WAIT) -> SettleResult:
+    """Poll a screen region until stable_frames consecutive frames match, or timeout expires.
+
+    reference is the region as it was before an input such as a scroll. Apps
+    take a moment to start repainting, so frames that still match it aren't
+    counted as stable until the region has moved away from it, or until
+    repaint_wait has passed without any change (the input did nothing).
+    """
+    started = time.monotonic()
+    reference_gray = to_gray_array(reference, SETTLE_COMPARE_WIDTH) if reference is not None else None
+    moved = reference_gray is None
+    previous = None
+    matching = 1
+    frames = 0
+    pixels = None
+    while True:
+        # Frames grabbed for other consumers within half a poll interval are as good as a new grab
+        pixels, _ = await frame_cache.capture(region, max_age=interval / 2)
+        frames += 1
+        current = to_gray_array(pixels, SETTLE_COMPARE_WIDTH)
+        elapsed = time.monotonic() - started
+        if not moved and not frames_identical(reference_gray, current, threshold):
+            moved = True
+        counting = moved or elapsed >= repaint_wait
+        if counting and previous is not None and frames_identical(previous, current, threshold):
+            matching += 1
+        else:
+            matching = 1
+        previous = current
+        if matching >= stable_frames or elapsed >= timeout:
+            metrics.observe(STAGE_SECONDS, elapsed, stage="settle")
+        if matching >= stable_frames:
+            return SettleResult(True, elapsed, frames, Image.fromarray(pixels), moved)
+        if elapsed >= timeout:
+            logger.info(f"Screen did not settle within {timeout:.2f}s ({frames} frames)")
+            metrics.inc("chicory_settle_timeouts_total")
+            return SettleResult(False, elapsed, frames, Image.fromarray(pixels), moved)
+        await asyncio.sleep(interval)
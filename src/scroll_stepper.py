@@ -0,0 +1,113 @@
+import os
+import logging
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Initial guess for how far one pyautogui.scroll unit moves the page; corrected by measurement
+DEFAULT_PIXELS_PER_UNIT = float(os.getenv('CHICORY_PIXELS_PER_SCROLL_UNIT', '3.0'))
+
+# Times a scroll that overshot the overlap is undone and retried smaller before giving up on it
+MAX_OVERSHOOT_RETRIES = 3
+
+# Measurements further than this factor from the expected displacement are taken as mismeasured
+MAX_SAMPLE_RATIO = 2.0
+# A calibrated scroll that moved less than this fraction of the expected distance may have hit the
+# end of the page, so it only counts once a later scroll shows the page kept moving
+SHORT_SAMPLE_RATIO = 0.8
+
+# Best estimate learned by previous sessions, so later sessions start calibrated
+_learned_pixels_per_unit: Optional[float] = None
+
+class AdaptiveScrollStepper:
+    """Sizes each scroll from the viewport height and wanted overlap.
+
+    Scroll units map to an unknown number of pixels that depends on the
+    platform and the application, so the stepper keeps an estimate of
+    pixels per unit and corrects it from the displacement measured between
+    consecutive screenshots. Once calibrated, a measurement is only trusted
+    within MAX_SAMPLE_RATIO of what the estimate predicts, and only trusted
+    measurements are shared with later sessions. A short scroll is held back
+    until the next one, since the last scroll of a page stops at its end.
+    """
+
+    def __init__(self, viewport_height: int, overlap_pixels: int,
+                 pixels_per_unit: Optional[float] = None, smoothing: float = 0.5):
+        self.viewport_height = viewport_height
+        self.overlap_pixels = min(overlap_pixels, viewport_height - 1)
+        self.target_pixels = viewport_height - self.overlap_pixels
+        self.pixels_per_unit = pixels_per_unit or _learned_pixels_per_unit or DEFAULT_PIXELS_PER_UNIT
+        self.smoothing = smoothing
+        self.calibrated = pixels_per_unit is not None or _learned_pixels_per_unit is not None
+        self._short_sample: Optional[float] = None
+
+    def next_units(self) -> int:
+        """Scroll units for the next step.
+
+        Until a measurement has confirmed the estimate, only a third of the
+        target is requested so an under-estimate can't scroll past the overlap.
+        """
+        target = self.target_pixels if self.calibrated else self.target_pixels / 3
+        return max(1, round(target / self.pixels_per_unit))
+
+    def expected_pixels(self, units: int) -> int:
+        return round(units * self.pixels_per_unit)
+
+    def search_range(self, units: int) -> Optional[Tuple[int, int]]:
+        """Displacements (pixels) worth looking for after scrolling units, or None to search everything"""
+        if not self.calibrated:
+            return None
+        expected = units * self.pixels_per_unit
+        return int(expected / MAX_SAMPLE_RATIO), int(expected * MAX_SAMPLE_RATIO + 0.5)
+
+    def plausible(self, units: int, measured_pixels: float) -> bool:
+        """True if a measurement is within MAX_SAMPLE_RATIO of the displacement the estimate predicts"""
+        if units <= 0 or measured_pixels <= 0:
+            return False
+        if not self.calibrated:
+            return True
+        ratio = measured_pixels / (units * self.pixels_per_unit)
+        return 1 / MAX_SAMPLE_RATIO <= ratio <= MAX_SAMPLE_RATIO
+
+    def _apply(self, sample: float):
+        global _learned_pixels_per_unit
+        if self.calibrated:
+            self.pixels_per_unit += self.smoothing * (sample - self.pixels_per_unit)
+            _learned_pixels_per_unit = self.pixels_per_unit
+        else:
+            self.pixels_per_unit = sample
+            self.calibrated = True
+        logger.info(f"Scroll calibration: {sample:.2f} px/unit measured, estimate {self.pixels_per_unit:.2f}")
+
+    def record(self, units: int, measured_pixels: Optional[float]) -> bool:
+        """Correct the estimate from a measured displacement; None means it couldn't be measured.
+
+        Returns whether the measurement was trusted. The first measurement of
+        an uncalibrated stepper sets the estimate but is only shared with
+        later sessions once a second measurement agrees with it.
+        """
+        if measured_pixels is None:
+            return False
+        if not self.plausible(units, measured_pixels):
+            logger.info(f"Scroll calibration: ignoring {measured_pixels}px for {units} units "
+                        f"(expected about {self.expected_pixels(units)}px)")
+            return False
+        sample = measured_pixels / units
+        if self._short_sample is not None:
+            # The page moved again, so the previous short scroll wasn't the end of the page
+            self._apply(self._short_sample)
+            self._short_sample = None
+        if self.calibrated and sample < self.pixels_per_unit * SHORT_SAMPLE_RATIO:
+            self._short_sample = sample
+        else:
+            self._apply(sample)
+        return True
+
+    def overshot(self):
+        """The last scroll went past the overlap, so the page moves more per unit than estimated.
+
+        Doubles the estimate and starts calibrating again with cautious steps.
+        """
+        self.pixels_per_unit *= 2
+        self.calibrated = False
+        self._short_sample = None
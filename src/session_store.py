@@ -0,0 +1,240 @@
+import io
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+import zipfile
+import threading
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from PIL import Image
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPTURE_DIR = "captures"
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 3600  # One week
+SESSION_SUFFIX = ".zip"
+PARTIAL_SUFFIX = ".zip.partial"
+# Partial files this old belong to a crashed process, not a session still being written
+STALE_PARTIAL_SECONDS = 3600
+
+SESSION_ID_PATTERN = re.compile(r'^[0-9]{8}_[0-9]{6}_[0-9a-f]{8}$')
+
+class CaptureSession:
+    """One scroll-and-capture session being written to a single zip container.
+
+    Screenshots are appended as they arrive (stored, since PNG is already
+    compressed); JSON documents are kept in memory and written once when the
+    session is closed. All file work happens on the store's writer thread.
+    """
+
+    def __init__(self, store: "SessionStore", session_id: str):
+        self.store = store
+        self.id = session_id
+        self.path = os.path.join(store.root, session_id + SESSION_SUFFIX)
+        self._partial_path = os.path.join(store.root, session_id + PARTIAL_SUFFIX)
+        self._archive: Optional[zipfile.ZipFile] = None
+        self._documents: Dict[str, Any] = {}
+        self._close_future: Optional[Future] = None
+
+    def _open(self) -> zipfile.ZipFile:
+        # Writer thread only
+        if self._archive is None:
+            self._archive = zipfile.ZipFile(self._partial_path, 'w')
+        return self._archive
+
+    def _write_image(self, name: str, image: Image.Image, compress_level: int):
+        with metrics.stage("disk_write"):
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', compress_level=compress_level)
+            self._open().writestr(f"images/{name}.png", buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+
+    def add_image(self, name: str, image: Image.Image, compress_level: int = 1) -> asyncio.Future:
+        """Queue a screenshot for the container and return an awaitable future"""
+        return asyncio.wrap_future(self.store.executor.submit(self._write_image, name, image, compress_level))
+
+    def put_json(self, name: str, data: Any):
+        """Set a JSON document; documents are written when the session closes"""
+        self._documents[name] = data
+
+    def _finish(self):
+        with metrics.stage("disk_write"):
+            archive = self._open()
+            for name, data in self._documents.items():
+                archive.writestr(f"{name}.json", json.dumps(data), compress_type=zipfile.ZIP_DEFLATED)
+            archive.close()
+            os.replace(self._partial_path, self.path)
+        self.store.enforce_retention()
+
+    def close_nowait(self) -> Future:
+        """Finalize the container on the writer thread without waiting, e.g. while being cancelled"""
+        if self._close_future is None:
+            self._close_future = self.store.executor.submit(self._finish)
+        return self._close_future
+
+    async def close(self):
+        """Write the documents, finalize the container and apply the store's retention policy"""
+        await asyncio.wrap_future(self.close_nowait())
+
+class SessionReader:
+    """Read access to a finished session; only the zip index is read up front"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.id = os.path.basename(path)[:-len(SESSION_SUFFIX)]
+        self._archive = zipfile.ZipFile(path)
+        self._documents: Dict[str, Any] = {}
+
+    def __enter__(self) -> "SessionReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._archive.close()
+
+    @property
+    def document_names(self) -> List[str]:
+        return sorted(name[:-len('.json')] for name in self._archive.namelist()
+                      if name.endswith('.json') and '/' not in name)
+
+    @property
+    def image_names(self) -> List[str]:
+        return sorted(name[len('images/'):-len('.png')] for name in self._archive.namelist()
+                      if name.startswith('images/'))
+
+    def document(self, name: str, default: Any = None) -> Any:
+        if name not in self._documents:
+            try:
+                self._documents[name] = json.loads(self._archive.read(f"{name}.json"))
+            except KeyError:
+                return default
+        return self._documents[name]
+
+    def image_bytes(self, name: str) -> bytes:
+        return self._archive.read(f"images/{name}.png")
+
+    def image(self, name: str) -> Image.Image:
+        image = Image.open(io.BytesIO(self.image_bytes(name)))
+        image.load()
+        return image
+
+    def viewport(self, index: int) -> Image.Image:
+        """Screenshot of one viewport, read without touching the others"""
+        return self.image(f"viewport_{index}")
+
+    def viewport_analysis(self, index: int) -> Optional[dict]:
+        analyses = self.document("viewport_analyses", {})
+        return analyses.get(str(index))
+
+class SessionStore:
+    """Capture sessions stored as one zip container each, with size and age based retention.
+
+    Sessions older than max_age_seconds are deleted, then the oldest remaining
+    ones until the total size is within max_bytes. Session ids are a timestamp
+    plus a random suffix, so concurrent sessions never collide.
+    """
+
+    def __init__(self, root: str = DEFAULT_CAPTURE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evictions = 0
+        # One writer thread keeps container writes ordered and off the capture path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-store')
+        self._lock = threading.Lock()
+
+    def create(self) -> CaptureSession:
+        os.makedirs(self.root, exist_ok=True)
+        session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        return CaptureSession(self, session_id)
+
+    def _session_path(self, session_id: str) -> str:
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id}")
+        return os.path.join(self.root, session_id + SESSION_SUFFIX)
+
+    def exists(self, session_id: str) -> bool:
+        try:
+            return os.path.exists(self._session_path(session_id))
+        except ValueError:
+            return False
+
+    def open(self, session_id: str) -> SessionReader:
+        """Reader for a finished session; raises FileNotFoundError if it doesn't exist"""
+        return SessionReader(self._session_path(session_id))
+
+    def _entries(self) -> List[os.DirEntry]:
+        if not os.path.isdir(self.root):
+            return []
+        with os.scandir(self.root) as entries:
+            return [entry for entry in entries
+                    if entry.is_file() and entry.name.endswith((SESSION_SUFFIX, PARTIAL_SUFFIX))]
+
+    def list(self) -> List[dict]:
+        sessions = []
+        for entry in self._entries():
+            if not entry.name.endswith(SESSION_SUFFIX):
+                continue
+            stat = entry.stat()
+            sessions.append({"session_id": entry.name[:-len(SESSION_SUFFIX)],
+                             "size_bytes": stat.st_size, "modified_at": stat.st_mtime})
+        return sorted(sessions, key=lambda session: session["session_id"])
+
+    def enforce_retention(self) -> int:
+        """Delete expired and over-budget sessions (plus stale partial files); returns how many were removed"""
+        with self._lock:
+            now = time.time()
+            removed = 0
+            sessions = []
+            for entry in self._entries():
+                stat = entry.stat()
+                if entry.name.endswith(PARTIAL_SUFFIX):
+                    if now - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                        removed += self._delete(entry.path)
+                    continue
+                if self.max_age_seconds and now - stat.st_mtime > self.max_age_seconds:
+                    removed += self._delete(entry.path)
+                    continue
+                sessions.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in sessions)
+            for _, size, path in sorted(sessions):
+                if total <= self.max_bytes:
+                    break
+                removed += self._delete(path)
+                total -= size
+            self.evictions += removed
+            return removed
+
+    def _delete(self, path: str) -> int:
+        try:
+            os.remove(path)
+            logger.info(f"Removed capture session {os.path.basename(path)}")
+            return 1
+        except OSError:
+            return 0
+
+    def stats(self) -> dict:
+        sessions = self.list()
+        return {
+            "root": self.root,
+            "sessions": len(sessions),
+            "size_bytes": sum(session["size_bytes"] for session in sessions),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "evictions": self.evictions
+        }
+
+session_store = SessionStore(
+    root=os.getenv('CHICORY_CAPTURE_DIR', DEFAULT_CAPTURE_DIR),
+    max_bytes=int(os.getenv('CHICORY_CAPTURE_MAX_BYTES', str(DEFAULT_MAX_BYTES))),
+    max_age_seconds=float(os.getenv('CHICORY_CAPTURE_MAX_AGE', str(DEFAULT_MAX_AGE_SECONDS)))
+)
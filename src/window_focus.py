@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+from typing import Optional, List
+
+logger = logging.getLogger(__name__)
+
+class FocusBackend(ABC):
+    """Brings the window of a process to the front"""
+    name = "base"
+
+    @abstractmethod
+    def focus(self, process_id: int) -> bool:
+        """Focus the process's window; True once it is frontmost"""
+
+class AppleScriptFocusBackend(FocusBackend):
+    """macOS: set the process frontmost through System Events"""
+    name = "applescript"
+
+    def __init__(self, settle_delay: float = 0.2):
+        # Small delay to ensure window is focused before input is sent
+        self.settle_delay = settle_delay
+
+    def focus(self, process_id: int) -> bool:
+        script = f'''
+        tell application "System Events"
+            set frontmost of the first process whose unix id is {process_id} to true
+        end tell
+        '''
+        subprocess.run(['osascript', '-e', script], check=True)
+        if self.settle_delay:
+            time.sleep(self.settle_delay)
+        return True
+
+class X11FocusBackend(FocusBackend):
+    """Linux/X11: activate the process's window with xdotool, which waits for the switch itself"""
+    name = "x11"
+
+    def focus(self, process_id: int) -> bool:
+        if not shutil.which('xdotool'):
+            raise RuntimeError("xdotool is required for window focus on X11")
+        result = subprocess.run(['xdotool', 'search', '--onlyvisible', '--pid', str(process_id)],
+                                check=True, capture_output=True, text=True)
+        window_ids = result.stdout.split()
+        if not window_ids:
+            return False
+        subprocess.run(['xdotool', 'windowactivate', '--sync', window_ids[0]], check=True)
+        return True
+
+class NoopFocusBackend(FocusBackend):
+    """Does nothing but remember the calls; for platforms without a backend and for tests"""
+    name = "noop"
+
+    def __init__(self):
+        self.calls: List[int] = []
+
+    def focus(self, process_id: int) -> bool:
+        self.calls.append(process_id)
+        return True
+
+def default_backend() -> FocusBackend:
+    """Backend from CHICORY_FOCUS_BACKEND, or the one for this platform"""
+    name = os.getenv('CHICORY_FOCUS_BACKEND')
+    if not name:
+        if sys.platform == 'darwin':
+            name = 'applescript'
+        elif sys.platform.startswith('linux') and os.getenv('DISPLAY'):
+            name = 'x11'
+        else:
+            name = 'noop'
+    backends = {
+        'applescript': AppleScriptFocusBackend,
+        'x11': X11FocusBackend,
+        'noop': NoopFocusBackend
+    }
+    if name not in backends:
+        raise ValueError(f"Unknown focus backend: {name}")
+    return backends[name]()
+
+class FocusManager:
+    """Focuses windows through a backend, skipping calls for the process focused within the last validity_seconds"""
+
+    def __init__(self, backend: Optional[FocusBackend] = None, validity_seconds: float = 5.0):
+        self.backend = backend or default_backend()
+        self.validity_seconds = validity_seconds
+        self._lock = threading.Lock()
+        self._last_pid: Optional[int] = None
+        self._last_focused_at = 0.0
+        self.focus_calls = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.total_focus_time = 0.0
+        self.last_focus_time = 0.0
+
+    def invalidate(self):
+        """Forget the cached focus, e.g. after something else may have taken it"""
+        with self._lock:
+            self._last_pid = None
+
+    def ensure_focused(self, process_id: int) -> bool:
+        with self._lock:
+            if (process_id == self._last_pid
+                    and time.monotonic() - self._last_focused_at < self.validity_seconds):
+                self.cache_hits += 1
+                return True
+            started = time.monotonic()
+            try:
+                focused = self.backend.focus(process_id)
+            except Exception as e:
+                logger.error(f"Error focusing window: {e}")
+                focused = False
+            elapsed = time.monotonic() - started
+            self.focus_calls += 1
+            self.total_focus_time += elapsed
+            self.last_focus_time = elapsed
+            if focused:
+                self._last_pid = process_id
+                self._last_focused_at = time.monotonic()
+            else:
+                self.failures += 1
+                self._last_pid = None
+            return focused
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "validity_seconds": self.validity_seconds,
+                "focus_calls": self.focus_calls,
+                "cache_hits": self.cache_hits,
+                "failures": self.failures,
+                "total_focus_time": round(self.total_focus_time, 4),
+                "last_focus_time": round(self.last_focus_time, 4),
+                "average_focus_time": round(self.total_focus_time / self.focus_calls, 4) if self.focus_calls else 0.0
+            }
+
+focus_manager = FocusManager(validity_seconds=float(os.getenv('CHICORY_FOCUS_CACHE_SECONDS', '5.0')))
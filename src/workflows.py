@@ -0,0 +1,167 @@
+import io
+import os
+import re
+import json
+import time
+import base64
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from frame_utils import to_gray_array, frame_difference
+from screen_capture import Frame, Region, frame_cache, _grab_screen
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKFLOW_DIR = "workflows"
+# Screen checks compare tiny thumbnails; enough to tell "same page, same state" from anything else
+SIGNATURE_WIDTH = 96
+# Mean difference tolerated between the recorded and current screen (cursor, caret, clock)
+DEFAULT_MATCH_THRESHOLD = 0.03
+TARGET_MARGIN = 24  # Pixels of surroundings kept around a clicked element's snapshot
+
+WORKFLOW_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def screen_signature(pixels: np.ndarray) -> dict:
+    """Small grayscale thumbnail of a screen region, stored with each recorded step"""
+    gray = (to_gray_array(pixels, SIGNATURE_WIDTH) * 255).round().astype(np.uint8)
+    return {"width": gray.shape[1], "height": gray.shape[0], "data": base64.b64encode(gray.tobytes()).decode()}
+
+def signature_difference(signature: dict, pixels: np.ndarray) -> float:
+    """Mean difference between a recorded signature and the current pixels, 0.0 (same) to 1.0"""
+    recorded = np.frombuffer(base64.b64decode(signature["data"]), dtype=np.uint8)
+    recorded = recorded.reshape(signature["height"], signature["width"]).astype(np.float32) / 255.0
+    return frame_difference(recorded, to_gray_array(pixels, SIGNATURE_WIDTH))
+
+def target_snapshot(frame: Frame, bbox: dict, margin: int = TARGET_MARGIN) -> Optional[str]:
+    """PNG (base64) of a clicked element and its surroundings, used to find it again if the screen changes"""
+    pixels = frame.crop((bbox["x"] - margin, bbox["y"] - margin, bbox["width"] + 2 * margin, bbox["height"] + 2 * margin))
+    if pixels.size == 0:
+        return None
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG', compress_level=1)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+class WorkflowStore:
+    """Workflows saved as one JSON file each under root"""
+
+    def __init__(self, root: str = DEFAULT_WORKFLOW_DIR):
+        self.root = root
+
+    def path(self, name: str) -> str:
+        if not WORKFLOW_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid workflow name: {name}")
+        return os.path.join(self.root, f"{name}.json")
+
+    def save(self, workflow: dict):
+        path = self.path(workflow["name"])
+        os.makedirs(self.root, exist_ok=True)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(workflow, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, name: str) -> dict:
+        """Workflow by name; raises FileNotFoundError if there is none"""
+        with open(self.path(name)) as f:
+            return json.load(f)
+
+    def delete(self, name: str) -> bool:
+        try:
+            os.remove(self.path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self) -> List[dict]:
+        if not os.path.isdir(self.root):
+            return []
+        workflows = []
+        for filename in sorted(os.listdir(self.root)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                workflow = self.load(filename[:-len('.json')])
+            except (OSError, ValueError):
+                continue
+            workflows.append({"name": workflow["name"], "description": workflow.get("description"),
+                              "steps": len(workflow["steps"]), "created_at": workflow.get("created_at")})
+        return workflows
+
+class WorkflowRecorder:
+    """Collects successful actions into a workflow while a recording is running.
+
+    There is one recorder per service since there is one desktop: every
+    action executed between start() and stop() is recorded, with a screen
+    signature taken just before it so replay can tell whether the screen
+    still looks the same.
+    """
+
+    def __init__(self, store: WorkflowStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._workflow: Optional[dict] = None
+        self._last_step_end: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self._workflow is not None
+
+    def start(self, name: str, description: Optional[str] = None):
+        self.store.path(name)  # Validate the name before recording anything
+        with self._lock:
+            if self._workflow is not None:
+                raise RuntimeError(f"Already recording workflow {self._workflow['name']}")
+            self._workflow = {"name": name, "description": description, "created_at": time.time(), "steps": []}
+            self._last_step_end = None
+
+    async def snapshot(self, region: Optional[Region]) -> Optional[Tuple[np.ndarray, Frame]]:
+        """Pre-action screen for the next recorded step, or None if it can't be grabbed"""
+        try:
+            return await frame_cache.capture(region, max_age=0.05)
+        except Exception as e:
+            logger.warning(f"Could not capture reference frame for workflow step: {e}")
+            return None
+
+    def snapshot_now(self, region: Optional[Region]) -> Optional[Tuple[np.ndarray, Frame]]:
+        """Same as snapshot, grabbed directly for callers already running on the input thread"""
+        try:
+            frame = _grab_screen()
+            return frame.crop(region), frame
+        except Exception as e:
+            logger.warning(f"Could not capture reference frame for workflow step: {e}")
+            return None
+
+    def record(self, action: Dict[str, Any], window: Optional[Dict[str, Any]], region: Optional[Region],
+               reference: Optional[Tuple[np.ndarray, Frame]], started: float, elapsed: float):
+        """Append one successful action; started is its time.monotonic() start"""
+        step = {
+            "action": action,
+            "window": window,
+            "region": list(region) if region else None,
+            "delay": round(started - self._last_step_end, 3) if self._last_step_end is not None else 0.0,
+            "elapsed": round(elapsed, 4),
+            "screen": None,
+            "target_image": None
+        }
+        if reference is not None:
+            pixels, frame = reference
+            step["screen"] = screen_signature(pixels)
+            if action.get("bbox"):
+                step["target_image"] = target_snapshot(frame, action["bbox"])
+        with self._lock:
+            if self._workflow is None:
+                return
+            self._workflow["steps"].append(step)
+            self._last_step_end = started + elapsed
+
+    def stop(self, save: bool = True) -> Optional[dict]:
+        """End the recording, saving it unless save is False; returns the workflow"""
+        with self._lock:
+            workflow, self._workflow = self._workflow, None
+        if workflow is not None and save:
+            self.store.save(workflow)
+        return workflow
+
+workflow_store = WorkflowStore(os.getenv('CHICORY_WORKFLOW_DIR', DEFAULT_WORKFLOW_DIR))
+workflow_recorder = WorkflowRecorder(workflow_store)
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from analysis_merge import merge_analyses, compare_records, DIFFERENT, UNSURE
+
+def record(index: int) -> dict:
+    return {"title": f"Record {index}", "text": f"Body text of record {index}"}
+
+def test_distinct_records_from_one_template_survive_merge():
+    # Three overlapping viewports, each repeating the last record of the one before
+    analyses = [{"content": [record(i) for i in range(0, 5)]},
+                {"content": [record(i) for i in range(4, 9)]},
+                {"content": [record(i) for i in range(8, 13)]}]
+    merged, unresolved, stats = merge_analyses(analyses)
+    assert merged["content"] == [record(i) for i in range(13)]
+    assert unresolved == []
+    assert stats["exact_duplicates"] == 2
+    assert stats["fuzzy_merged"] == 0
+
+def test_products_differing_in_one_field_are_different_items():
+    a = {"name": "USB-C cable 1m", "price": "$9.99"}
+    b = {"name": "USB-C cable 2m", "price": "$9.99"}
+    assert compare_records(a, b) == DIFFERENT
+    merged, _, _ = merge_analyses([{"content": [a]}, {"content": [b]}])
+    assert merged["content"] == [a, b]
+
+def test_record_cut_off_at_the_boundary_is_merged():
+    full = {"title": "Record 4", "text": "Body text of record 4, which runs on for a while"}
+    cut = {"title": "Record 4", "text": "Body text of record 4"}
+    merged, unresolved, stats = merge_analyses([{"content": [record(3), cut]},
+                                                {"content": [full, record(5)]}])
+    assert merged["content"] == [record(3), full, record(5)]
+    assert stats["fuzzy_merged"] == 1
+    assert unresolved == []
+
+def test_cut_off_records_away_from_the_boundary_are_not_merged():
+    cut = {"title": "Record 1", "text": "Body text of record 1"}
+    full = {"title": "Record 1", "text": "Body text of record 1, which runs on for a while"}
+    # The cut-off copy is first in its viewport, so it can't be split by the overlap below it
+    analyses = [{"content": [cut] + [record(i) for i in range(10, 14)]},
+                {"content": [record(i) for i in range(20, 24)] + [full]}]
+    merged, _, stats = merge_analyses(analyses)
+    assert len(merged["content"]) == 10
+    assert stats["fuzzy_merged"] == 0
+
+def test_weak_boundary_match_is_left_unresolved():
+    # A short title that could be the start of the longer one is not enough to merge on
+    a = {"title": "Weekly update: shipping"}
+    b = {"title": "Weekly update"}
+    assert compare_records(a, b) == UNSURE
+    merged, unresolved, stats = merge_analyses([{"content": [record(1), a]}, {"content": [b, record(2)]}])
+    assert merged["content"] == [record(1), a, b, record(2)]
+    assert [(pair["index_a"], pair["index_b"]) for pair in unresolved] == [(1, 2)]
+    assert stats["unresolved"] == 1
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from frame_utils import measure_vertical_shift
+
+VIEWPORT = 200
+
+def textured_page(height: int = 1000, width: int = 128, seed: int = 0) -> np.ndarray:
+    # Blocks of random gray so every stretch of rows looks different
+    rng = np.random.default_rng(seed)
+    blocks = rng.random((height // 4 + 1, width // 8), dtype=np.float32)
+    return np.kron(blocks, np.ones((4, 8), dtype=np.float32))[:height, :width]
+
+def viewport(page: np.ndarray, offset: int) -> np.ndarray:
+    # Like a browser, the last scroll stops at the end of the page
+    offset = min(offset, page.shape[0] - VIEWPORT)
+    return page[offset:offset + VIEWPORT]
+
+def test_shift_is_measured():
+    page = textured_page()
+    assert measure_vertical_shift(viewport(page, 100), viewport(page, 160)) == 60
+
+def test_unchanged_frame_measures_zero_even_outside_the_search_window():
+    page = textured_page()
+    assert measure_vertical_shift(viewport(page, 100), viewport(page, 100), search=(40, 80)) == 0
+
+def test_repeating_rows_are_ambiguous():
+    # A list built from one template: every 40 rows look the same
+    page = np.tile(textured_page(40), (25, 1))
+    assert measure_vertical_shift(viewport(page, 0), viewport(page, 60)) is None
+
+def test_shift_past_the_overlap_is_not_measured():
+    page = textured_page()
+    assert measure_vertical_shift(viewport(page, 0), viewport(page, 250)) is None
+
+def test_partial_last_scroll_measures_the_distance_actually_moved():
+    page = textured_page()
+    # Asked for 150 rows, but only 50 were left below the viewport
+    assert measure_vertical_shift(viewport(page, 750), viewport(page, 900)) == 50
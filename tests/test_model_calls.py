@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from model_calls import AdaptiveLimiter, ModelCaller, ModelCallError
+
+class ResourceExhausted(Exception):
+    code = 429
+
+class InvalidArgument(Exception):
+    code = 400
+
+class Response:
+    def __init__(self, text: str):
+        self.text = text
+
+class ScriptedModel:
+    """Raises or answers in the given order, optionally taking delay seconds per call"""
+
+    def __init__(self, *outcomes, delay: float = 0.0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        outcome = self.outcomes.pop(0) if self.outcomes else '{"ok": true}'
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return Response(outcome)
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+def caller(**kwargs) -> ModelCaller:
+    options = {"max_attempts": 3, "deadline": 5.0, "backoff_base": 0.001, "backoff_max": 0.01}
+    options.update(kwargs)
+    return ModelCaller(AdaptiveLimiter(initial=2, max_limit=4, cooldown=60.0), **options)
+
+def test_fast_calls_raise_the_limit():
+    limiter = AdaptiveLimiter(initial=2, max_limit=4)
+
+    async def run():
+        for _ in range(3):
+            await limiter.acquire()
+            limiter.release(0.1)
+    asyncio.run(run())
+    # About one slot per limit's worth of calls: 2 + 1/2 + 1/2.5 + 1/2.9
+    assert limiter.stats()["limit"] == 3
+    assert limiter.increases == 3
+    assert limiter.in_flight == 0
+
+def test_overload_halves_the_limit_once_per_cooldown():
+    limiter = AdaptiveLimiter(initial=8, max_limit=8, cooldown=60.0)
+
+    async def run():
+        for _ in range(3):
+            await limiter.acquire()
+        for _ in range(3):
+            limiter.release(0.1, overloaded=True)
+    asyncio.run(run())
+    assert limiter.limit == 4.0
+    assert limiter.decreases == 1
+
+def test_slow_calls_lower_the_limit():
+    limiter = AdaptiveLimiter(initial=4, latency_target=1.0, cooldown=0.0)
+
+    async def run():
+        await limiter.acquire()
+        limiter.release(2.0)
+    asyncio.run(run())
+    assert limiter.limit == 2.0
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+
+    async def run():
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # The slot goes to the first waiter, which is cancelled before it gets to run
+        limiter.release(0.1)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.wait_for(second, 1.0)
+        assert limiter.in_flight == 1
+        limiter.release(0.1)
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+
+def test_retryable_errors_are_retried(executor):
+    model = ScriptedModel(ResourceExhausted("quota"), "not json", '{"answer": 42}')
+    model_caller = caller()
+    result = asyncio.run(model_caller.call_json(executor, model, "prompt"))
+    assert result == {"answer": 42}
+    assert model.calls == 3
+    assert model_caller.limiter.decreases == 1
+
+def test_fatal_errors_are_not_retried(executor):
+    model = ScriptedModel(InvalidArgument("bad request"))
+    with pytest.raises(InvalidArgument):
+        asyncio.run(caller().call_json(executor, model, "prompt"))
+    assert model.calls == 1
+
+def test_attempts_are_limited(executor):
+    model = ScriptedModel(*[ResourceExhausted("quota")] * 5)
+    with pytest.raises(ModelCallError) as raised:
+        asyncio.run(caller().call_json(executor, model, "prompt"))
+    assert raised.value.attempts == 3
+    assert model.calls == 3
+
+def test_deadline_stops_a_slow_call(executor):
+    model = ScriptedModel(delay=0.5)
+    model_caller = caller()
+    started = time.monotonic()
+    with pytest.raises(ModelCallError, match="deadline"):
+        asyncio.run(model_caller.call_json(executor, model, "prompt", deadline=0.1))
+    assert time.monotonic() - started < 0.4
+
+def test_model_and_contents_are_resolved_on_the_worker_thread(executor):
+    model = ScriptedModel()
+    threads = []
+
+    def model_factory():
+        threads.append(threading.current_thread())
+        return model
+
+    def prepare_contents(contents):
+        threads.append(threading.current_thread())
+        return contents
+
+    model_caller = caller(model_factory=model_factory, prepare_contents=prepare_contents)
+    assert asyncio.run(model_caller.call_json(executor, None, "prompt")) == {"ok": True}
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
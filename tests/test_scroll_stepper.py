@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import scroll_stepper
+from scroll_stepper import AdaptiveScrollStepper
+
+@pytest.fixture(autouse=True)
+def fresh_calibration(monkeypatch):
+    monkeypatch.setattr(scroll_stepper, '_learned_pixels_per_unit', None)
+
+def test_uncalibrated_stepper_takes_cautious_steps_until_measured():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=None)
+    stepper.pixels_per_unit = 10.0
+    assert not stepper.calibrated
+    assert stepper.next_units() == 24
+    assert stepper.search_range(24) is None
+    assert stepper.record(24, 480)
+    assert stepper.calibrated
+    assert stepper.pixels_per_unit == 20.0
+    assert stepper.next_units() == 36
+    # The first measurement isn't shared until a second one agrees with it
+    assert scroll_stepper._learned_pixels_per_unit is None
+
+def test_calibrated_measurements_are_smoothed_and_shared():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=12.0)
+    assert stepper.search_range(60) == (360, 1440)
+    assert stepper.record(60, 840)
+    assert stepper.pixels_per_unit == 13.0
+    assert scroll_stepper._learned_pixels_per_unit == 13.0
+    assert AdaptiveScrollStepper(800, 80).calibrated
+
+def test_implausible_measurement_is_not_trusted():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=12.0)
+    assert not stepper.record(60, 2000)
+    assert not stepper.record(60, None)
+    assert stepper.pixels_per_unit == 12.0
+
+def test_short_last_scroll_does_not_change_the_estimate():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=12.0)
+    # The page ended 400px into a 720px scroll
+    assert stepper.record(60, 400)
+    assert stepper.pixels_per_unit == 12.0
+    assert scroll_stepper._learned_pixels_per_unit is None
+
+def test_short_scroll_counts_once_the_page_keeps_moving():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=12.0)
+    assert stepper.record(60, 480)
+    assert stepper.record(60, 720)
+    assert stepper.pixels_per_unit == 11.0
+
+def test_overshoot_doubles_the_estimate_and_recalibrates():
+    stepper = AdaptiveScrollStepper(800, 80, pixels_per_unit=6.0)
+    stepper.overshot()
+    assert stepper.pixels_per_unit == 12.0
+    assert not stepper.calibrated
+    assert stepper.next_units() == 20